@@ -0,0 +1,167 @@
+import asyncio
+import logging
+
+# Response latency above which the page size gets reduced
+CONST_PAGE_TARGET_LATENCY = 2.0
+# Response payload above which the page size gets reduced
+CONST_PAGE_MAX_PAYLOAD = 2_000_000
+
+
+class AdaptivePageSize:
+    """ Adjusts the size of requested pages from the observed response latency and payload size. """
+
+    def __init__(self, minimum: int, maximum: int, initial: int = 50,
+                 target_latency: float = CONST_PAGE_TARGET_LATENCY, max_payload: int = CONST_PAGE_MAX_PAYLOAD):
+        self.__logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.__minimum = max(1, minimum)
+        self.__maximum = max(self.__minimum, maximum)
+        self.__target_latency = target_latency
+        self.__max_payload = max_payload
+        self.__size = min(max(initial, self.__minimum), self.__maximum)
+
+    @property
+    def size(self) -> int:
+        return self.__size
+
+    def update(self, latency: float, payload_size: int, item_count: int):
+        """
+        Adjusts the page size after receiving a response.
+        :param latency: Response time in seconds
+        :param payload_size: Size of the response in bytes
+        :param item_count: Number of items received
+        """
+        if item_count == 0:
+            return  # Nothing to learn from an empty page
+
+        previous_size = self.__size
+        if latency > self.__target_latency or payload_size > self.__max_payload:
+            self.__size = max(self.__minimum, self.__size // 2)
+        elif item_count >= self.__size and latency < self.__target_latency / 2 and payload_size < self.__max_payload / 2:
+            # Full page received quickly, grow
+            self.__size = min(self.__maximum, self.__size * 2)
+
+        if previous_size != self.__size:
+            self.__logger.debug("Page size adjusted from %d to %d (latency: %.3fs, payload: %d bytes)",
+                                previous_size, self.__size, latency, payload_size)
+
+
+# insertViewData latency above which batches get smaller
+CONST_BATCH_TARGET_LATENCY = 1.0
+
+
+class AdaptiveBatchSize:
+    """
+    Limits batches by item count and serialized size. The limits are tuned from the measured
+    command latency, never exceeding the configured maximums.
+    """
+
+    def __init__(self, max_items: int, max_bytes: int, flush_seconds: float,
+                 target_latency: float = CONST_BATCH_TARGET_LATENCY):
+        self.__logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.__max_items_limit = max(1, max_items)
+        self.__max_bytes_limit = max(1, max_bytes)
+        self.__flush_seconds = flush_seconds
+        self.__target_latency = target_latency
+
+        # Start small, grow while the latency allows it
+        self.__max_items = min(20, self.__max_items_limit)
+        self.__max_bytes = max(1, self.__max_bytes_limit // 4)
+
+    @property
+    def max_items(self) -> int:
+        return self.__max_items
+
+    @property
+    def max_bytes(self) -> int:
+        return self.__max_bytes
+
+    @property
+    def flush_seconds(self) -> float:
+        return self.__flush_seconds
+
+    def is_full(self, item_count: int, size: int) -> bool:
+        return item_count >= self.__max_items or size >= self.__max_bytes
+
+    def update(self, latency: float, item_count: int, size: int):
+        """
+        Adjusts the limits after a batch was acknowledged.
+        :param latency: Command response time in seconds
+        :param item_count: Number of items in the batch
+        :param size: Serialized size of the batch in bytes
+        """
+        previous = (self.__max_items, self.__max_bytes)
+        if latency > self.__target_latency:
+            self.__max_items = max(1, self.__max_items // 2)
+            self.__max_bytes = max(1, self.__max_bytes // 2)
+        elif latency < self.__target_latency / 2 and self.is_full(item_count, size):
+            # Full batch acknowledged quickly, grow
+            self.__max_items = min(self.__max_items_limit, self.__max_items + max(1, self.__max_items // 2))
+            self.__max_bytes = min(self.__max_bytes_limit, self.__max_bytes + self.__max_bytes // 2)
+
+        if previous != (self.__max_items, self.__max_bytes):
+            self.__logger.debug("Batch limits adjusted to %d items / %d bytes (latency: %.3fs)",
+                                self.__max_items, self.__max_bytes, latency)
+
+
+class AimdWindow:
+    """
+    Limit of commands in flight, shared by all senders. Additive increase while commands are acknowledged
+    quickly, multiplicative decrease on slow responses and errors.
+    """
+
+    def __init__(self, maximum: int, target_latency: float = CONST_BATCH_TARGET_LATENCY):
+        self.__logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.__maximum = max(1, maximum)
+        self.__target_latency = target_latency
+        self.__size = 1.0
+        self.__in_flight = 0
+        self.__condition = asyncio.Condition()
+
+    @property
+    def size(self) -> int:
+        return max(1, int(self.__size))
+
+    @property
+    def in_flight(self) -> int:
+        return self.__in_flight
+
+    async def acquire(self):
+        async with self.__condition:
+            await self.__condition.wait_for(lambda: self.__in_flight < self.size)
+            self.__in_flight += 1
+
+    async def release(self):
+        async with self.__condition:
+            self.__in_flight -= 1
+            self.__condition.notify_all()
+
+    def on_success(self, latency: float):
+        if latency > self.__target_latency:
+            self.__decrease()
+        else:
+            # Grows by about 1 for each full window acknowledged
+            self.__size = min(float(self.__maximum), self.__size + 1 / self.__size)
+
+    def on_failure(self):
+        self.__decrease()
+
+    def __decrease(self):
+        previous = self.size
+        self.__size = max(1.0, self.__size / 2)
+        if previous != self.size:
+            self.__logger.debug("In-flight window reduced from %d to %d", previous, self.size)
+
+
+def estimate_serialized_size(value) -> int:
+    """
+    Approximate size of a value once serialized to json, without serializing it.
+    Faster than json.dumps for small values (items of a batch), slower for large ones (a getFeedData page).
+    """
+    if isinstance(value, str):
+        return len(value) + 2
+    elif isinstance(value, dict):
+        return 2 + sum(len(k) + 4 + estimate_serialized_size(v) for (k, v) in value.items())
+    elif isinstance(value, (list, tuple)):
+        return 2 + sum(estimate_serialized_size(v) + 1 for v in value)
+    else:
+        return 8  # Numbers, booleans, null
@@ -2,10 +2,11 @@ import aiohttp
 import asyncio
 import binascii
 import logging
+import os
 import tempfile
 
 from asyncio import TaskGroup
-from typing import Optional, Union
+from typing import AsyncIterator, Optional, Union
 from urllib.parse import urljoin
 
 from millegrilles_messages.chiffrage.DechiffrageUtils import get_decipher_cle_secrete
@@ -174,17 +175,51 @@ class AttachedFileHelper(AttachedFileInterface):
 
         return attached_file
 
-    async def download_file(self, fuuid: str, fp) -> int:
+    async def iter_download_file(self, fuuid: str) -> AsyncIterator[bytes]:
+        blob_cache = self.__context.blob_cache
+        cached_path = blob_cache.get(fuuid)
+        if cached_path is not None:
+            with open(cached_path, 'rb') as fp:
+                while True:
+                    chunk = await asyncio.to_thread(fp.read, 64*1024)
+                    if len(chunk) == 0:
+                        return
+                    yield chunk
+
         session = self.__session
         filehost_url = self.__filehost_url
         url_fichier = urljoin(filehost_url, f'filehost/files/{fuuid}')
         async with session.get(url_fichier) as resp:
+            if resp.status == 404:
+                await blob_cache.set_missing(fuuid)
             resp.raise_for_status()
 
-            file_size = 0
-            async for chunk in resp.content.iter_chunked(64*1024):
-                await asyncio.to_thread(fp.write, chunk)
-                file_size += len(chunk)
+            if blob_cache.enabled is False:
+                async for chunk in resp.content.iter_chunked(64*1024):
+                    yield chunk
+                return
+
+            # Keep a copy in the local cache, only committed once the file is complete
+            temp_file = blob_cache.open_temporary()
+            try:
+                async for chunk in resp.content.iter_chunked(64*1024):
+                    await asyncio.to_thread(temp_file.write, chunk)
+                    yield chunk
+                temp_file.close()
+                blob_cache.commit(fuuid, temp_file.name)
+            finally:
+                if temp_file.closed is False:
+                    temp_file.close()
+                try:
+                    os.unlink(temp_file.name)
+                except FileNotFoundError:
+                    pass  # Committed
+
+    async def download_file(self, fuuid: str, fp) -> int:
+        file_size = 0
+        async for chunk in self.iter_download_file(fuuid):
+            await asyncio.to_thread(fp.write, chunk)
+            file_size += len(chunk)
 
         return file_size
 
@@ -2,6 +2,8 @@ import argparse
 import os
 import logging
 
+from typing import Optional
+
 from millegrilles_messages.bus.BusConfiguration import MilleGrillesBusConfiguration
 
 # Configuration loader.
@@ -10,10 +12,66 @@ from millegrilles_messages.bus.BusConfiguration import MilleGrillesBusConfigurat
 # Environment variables
 ENV_DIR_DATA = 'DIR_DATA'
 ENV_FILEHOST_WEB_URL = 'FILEHOST_WEB_URL'
+ENV_DOWNLOAD_CONCURRENCY = 'DOWNLOAD_CONCURRENCY'
+ENV_FEED_PAGE_SIZE_MIN = 'FEED_PAGE_SIZE_MIN'
+ENV_FEED_PAGE_SIZE_MAX = 'FEED_PAGE_SIZE_MAX'
+ENV_FEED_DATA_CURSOR = 'FEED_DATA_CURSOR'
+ENV_KEY_CACHE_SIZE = 'KEY_CACHE_SIZE'
+ENV_KEY_CACHE_TTL = 'KEY_CACHE_TTL'
+ENV_BLOB_CACHE_SIZE = 'BLOB_CACHE_SIZE'
+ENV_BLOB_CACHE_MISSING_TTL = 'BLOB_CACHE_MISSING_TTL'
+ENV_STAGING_CODEC = 'STAGING_CODEC'
+ENV_BATCH_MAX_ITEMS = 'BATCH_MAX_ITEMS'
+ENV_BATCH_MAX_BYTES = 'BATCH_MAX_BYTES'
+ENV_BATCH_FLUSH_SECONDS = 'BATCH_FLUSH_SECONDS'
+ENV_SEND_WINDOW_MAX = 'SEND_WINDOW_MAX'
+ENV_ENCRYPTION_PROCESSES = 'ENCRYPTION_PROCESSES'
+ENV_MAPPER_CACHE_SIZE = 'MAPPER_CACHE_SIZE'
+ENV_MAPPER_BYTECODE_CACHE = 'MAPPER_BYTECODE_CACHE'
+ENV_MAPPER_PROCESSES = 'MAPPER_PROCESSES'
+ENV_MAPPER_BATCH_ITEMS = 'MAPPER_BATCH_ITEMS'
+ENV_MAPPER_CPU_BUDGET = 'MAPPER_CPU_BUDGET'
+ENV_MAPPER_TIMEOUT = 'MAPPER_TIMEOUT'
+ENV_PUBLISHED_INDEX = 'PUBLISHED_INDEX'
+ENV_PARSE_CACHE_SIZE = 'PARSE_CACHE_SIZE'
+ENV_PROCESS_WORKERS_MIN = 'PROCESS_WORKERS_MIN'
+ENV_PROCESS_WORKERS_MAX = 'PROCESS_WORKERS_MAX'
+ENV_PROCESS_QUEUE_SIZE = 'PROCESS_QUEUE_SIZE'
+ENV_PROCESS_WORKER_IDLE_TIMEOUT = 'PROCESS_WORKER_IDLE_TIMEOUT'
+ENV_PROCESS_DEBOUNCE = 'PROCESS_DEBOUNCE'
+ENV_PROCESS_TIME_SLICE = 'PROCESS_TIME_SLICE'
 
 # Default values
 DEFAULT_DIR_DATA="/var/opt/millegrilles/datasource_mapper/data"
 DEFAULT_FILEHOST_WEB_URL = 'https://filehost:1443/'
+DEFAULT_DOWNLOAD_CONCURRENCY = 8
+DEFAULT_FEED_PAGE_SIZE_MIN = 10
+DEFAULT_FEED_PAGE_SIZE_MAX = 500
+DEFAULT_FEED_DATA_CURSOR = True
+DEFAULT_KEY_CACHE_SIZE = 1000
+DEFAULT_KEY_CACHE_TTL = 3600  # Seconds
+DEFAULT_BLOB_CACHE_SIZE = 2_000_000_000  # Bytes, 0 disables the cache
+DEFAULT_BLOB_CACHE_MISSING_TTL = 86400  # Seconds
+DEFAULT_STAGING_CODEC = None  # Fastest available of zstd, lz4, gzip
+DEFAULT_BATCH_MAX_ITEMS = 200
+DEFAULT_BATCH_MAX_BYTES = 2_000_000
+DEFAULT_BATCH_FLUSH_SECONDS = 5.0
+DEFAULT_SEND_WINDOW_MAX = 8
+DEFAULT_ENCRYPTION_PROCESSES = 0  # 0 encrypts in the default thread pool
+DEFAULT_MAPPER_CACHE_SIZE = 32
+DEFAULT_MAPPER_BYTECODE_CACHE = True
+DEFAULT_MAPPER_PROCESSES = None  # One per core, 0 runs the mappers on the event loop
+DEFAULT_MAPPER_BATCH_ITEMS = 16
+DEFAULT_MAPPER_CPU_BUDGET = 60.0  # CPU seconds per data item
+DEFAULT_MAPPER_TIMEOUT = 300.0  # Seconds per data item
+DEFAULT_PUBLISHED_INDEX = True
+DEFAULT_PARSE_CACHE_SIZE = 500_000_000  # Bytes, 0 disables the cache
+DEFAULT_PROCESS_WORKERS_MIN = 2
+DEFAULT_PROCESS_WORKERS_MAX = None  # One per core
+DEFAULT_PROCESS_QUEUE_SIZE = 64
+DEFAULT_PROCESS_WORKER_IDLE_TIMEOUT = 60.0  # Seconds before an extra idle worker shuts down
+DEFAULT_PROCESS_DEBOUNCE = 5.0  # Seconds to wait for more feedDataUpdated triggers before queuing a job
+DEFAULT_PROCESS_TIME_SLICE = 30.0  # Seconds before a running job moves to the bulk priority class
 
 
 def _parse_command_line():
@@ -28,6 +86,12 @@ def _parse_command_line():
     return args
 
 
+def _parse_bool(value: Optional[str], default: bool) -> bool:
+    if value is None or value == '':
+        return default
+    return value.lower() in ['1', 'true', 'yes', 'on']
+
+
 LOGGING_NAMES = [__name__, 'millegrilles_messages', 'millegrilles_datasourcemapper']
 
 
@@ -47,11 +111,73 @@ class DatasourceMapperConfiguration(MilleGrillesBusConfiguration):
         super().__init__()
         self.dir_data = DEFAULT_DIR_DATA
         self.filehost_web_url = DEFAULT_FILEHOST_WEB_URL
+        self.download_concurrency = DEFAULT_DOWNLOAD_CONCURRENCY
+        self.feed_page_size_min = DEFAULT_FEED_PAGE_SIZE_MIN
+        self.feed_page_size_max = DEFAULT_FEED_PAGE_SIZE_MAX
+        self.feed_data_cursor = DEFAULT_FEED_DATA_CURSOR
+        self.key_cache_size = DEFAULT_KEY_CACHE_SIZE
+        self.key_cache_ttl = DEFAULT_KEY_CACHE_TTL
+        self.blob_cache_size = DEFAULT_BLOB_CACHE_SIZE
+        self.blob_cache_missing_ttl = DEFAULT_BLOB_CACHE_MISSING_TTL
+        self.staging_codec: Optional[str] = DEFAULT_STAGING_CODEC
+        self.batch_max_items = DEFAULT_BATCH_MAX_ITEMS
+        self.batch_max_bytes = DEFAULT_BATCH_MAX_BYTES
+        self.batch_flush_seconds = DEFAULT_BATCH_FLUSH_SECONDS
+        self.send_window_max = DEFAULT_SEND_WINDOW_MAX
+        self.encryption_processes = DEFAULT_ENCRYPTION_PROCESSES
+        self.mapper_cache_size = DEFAULT_MAPPER_CACHE_SIZE
+        self.mapper_bytecode_cache = DEFAULT_MAPPER_BYTECODE_CACHE
+        self.mapper_processes: Optional[int] = DEFAULT_MAPPER_PROCESSES
+        self.mapper_batch_items = DEFAULT_MAPPER_BATCH_ITEMS
+        self.mapper_cpu_budget = DEFAULT_MAPPER_CPU_BUDGET
+        self.mapper_timeout = DEFAULT_MAPPER_TIMEOUT
+        self.published_index = DEFAULT_PUBLISHED_INDEX
+        self.parse_cache_size = DEFAULT_PARSE_CACHE_SIZE
+        self.process_workers_min = DEFAULT_PROCESS_WORKERS_MIN
+        self.process_workers_max: Optional[int] = DEFAULT_PROCESS_WORKERS_MAX
+        self.process_queue_size = DEFAULT_PROCESS_QUEUE_SIZE
+        self.process_worker_idle_timeout = DEFAULT_PROCESS_WORKER_IDLE_TIMEOUT
+        self.process_debounce = DEFAULT_PROCESS_DEBOUNCE
+        self.process_time_slice = DEFAULT_PROCESS_TIME_SLICE
 
     def parse_config(self):
         super().parse_config()
         self.dir_data = os.environ.get(ENV_DIR_DATA) or self.dir_data
         self.filehost_web_url = os.environ.get(ENV_FILEHOST_WEB_URL) or self.filehost_web_url
+        self.download_concurrency = int(os.environ.get(ENV_DOWNLOAD_CONCURRENCY) or self.download_concurrency)
+        self.feed_page_size_min = int(os.environ.get(ENV_FEED_PAGE_SIZE_MIN) or self.feed_page_size_min)
+        self.feed_page_size_max = int(os.environ.get(ENV_FEED_PAGE_SIZE_MAX) or self.feed_page_size_max)
+        self.feed_data_cursor = _parse_bool(os.environ.get(ENV_FEED_DATA_CURSOR), self.feed_data_cursor)
+        self.key_cache_size = int(os.environ.get(ENV_KEY_CACHE_SIZE) or self.key_cache_size)
+        self.key_cache_ttl = int(os.environ.get(ENV_KEY_CACHE_TTL) or self.key_cache_ttl)
+        self.blob_cache_size = int(os.environ.get(ENV_BLOB_CACHE_SIZE) or self.blob_cache_size)
+        self.blob_cache_missing_ttl = int(os.environ.get(ENV_BLOB_CACHE_MISSING_TTL) or self.blob_cache_missing_ttl)
+        self.staging_codec = os.environ.get(ENV_STAGING_CODEC) or self.staging_codec
+        self.batch_max_items = int(os.environ.get(ENV_BATCH_MAX_ITEMS) or self.batch_max_items)
+        self.batch_max_bytes = int(os.environ.get(ENV_BATCH_MAX_BYTES) or self.batch_max_bytes)
+        self.batch_flush_seconds = float(os.environ.get(ENV_BATCH_FLUSH_SECONDS) or self.batch_flush_seconds)
+        self.send_window_max = int(os.environ.get(ENV_SEND_WINDOW_MAX) or self.send_window_max)
+        self.encryption_processes = int(os.environ.get(ENV_ENCRYPTION_PROCESSES) or self.encryption_processes)
+        self.mapper_cache_size = int(os.environ.get(ENV_MAPPER_CACHE_SIZE) or self.mapper_cache_size)
+        self.mapper_bytecode_cache = _parse_bool(os.environ.get(ENV_MAPPER_BYTECODE_CACHE), self.mapper_bytecode_cache)
+        mapper_processes = os.environ.get(ENV_MAPPER_PROCESSES)
+        if mapper_processes is not None and mapper_processes != '':
+            self.mapper_processes = int(mapper_processes)
+        self.mapper_batch_items = int(os.environ.get(ENV_MAPPER_BATCH_ITEMS) or self.mapper_batch_items)
+        self.mapper_cpu_budget = float(os.environ.get(ENV_MAPPER_CPU_BUDGET) or self.mapper_cpu_budget)
+        self.mapper_timeout = float(os.environ.get(ENV_MAPPER_TIMEOUT) or self.mapper_timeout)
+        self.published_index = _parse_bool(os.environ.get(ENV_PUBLISHED_INDEX), self.published_index)
+        self.parse_cache_size = int(os.environ.get(ENV_PARSE_CACHE_SIZE) or self.parse_cache_size)
+        self.process_workers_min = int(os.environ.get(ENV_PROCESS_WORKERS_MIN) or self.process_workers_min)
+        process_workers_max = os.environ.get(ENV_PROCESS_WORKERS_MAX)
+        if process_workers_max is not None and process_workers_max != '':
+            self.process_workers_max = int(process_workers_max)
+        self.process_queue_size = int(os.environ.get(ENV_PROCESS_QUEUE_SIZE) or self.process_queue_size)
+        self.process_worker_idle_timeout = float(os.environ.get(ENV_PROCESS_WORKER_IDLE_TIMEOUT) or self.process_worker_idle_timeout)
+        process_debounce = os.environ.get(ENV_PROCESS_DEBOUNCE)
+        if process_debounce is not None and process_debounce != '':
+            self.process_debounce = float(process_debounce)  # 0 disables the delay
+        self.process_time_slice = float(os.environ.get(ENV_PROCESS_TIME_SLICE) or self.process_time_slice)
 
     @staticmethod
     def load():
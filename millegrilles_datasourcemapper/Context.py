@@ -1,11 +1,19 @@
 import logging
+import os
+import pathlib
 
+from concurrent.futures import Executor, ProcessPoolExecutor
 from typing import Optional
 
+from millegrilles_datasourcemapper.AdaptiveSizing import AdaptiveBatchSize, AimdWindow
 from millegrilles_datasourcemapper.Configuration import DatasourceMapperConfiguration
 from millegrilles_messages.bus.BusContext import MilleGrillesBusContext
 from millegrilles_messages.bus.PikaConnector import MilleGrillesPikaConnector
 from millegrilles_datasourcemapper.DataStructures import AttachedFileInterface
+from millegrilles_datasourcemapper.DiskCache import BlobCache, ParseResultCache
+from millegrilles_datasourcemapper.KeyCache import DecryptedKeyCache
+from millegrilles_datasourcemapper.MapperCache import MapperCache
+from millegrilles_datasourcemapper.MapperPool import MapperProcessPool
 
 LOGGER = logging.getLogger(__name__)
 
@@ -18,6 +26,28 @@ class DatasourceMapperContext(MilleGrillesBusContext):
         self.__bus_connector: Optional[MilleGrillesPikaConnector] = None
         self.__file_handler: Optional[AttachedFileInterface] = None
         self.__scrape_throttle_seconds: Optional[int] = 5
+        self.__key_cache = DecryptedKeyCache(configuration.key_cache_size, configuration.key_cache_ttl)
+        self.__blob_cache = BlobCache(pathlib.Path(configuration.dir_data, 'blobs'),
+                                      configuration.blob_cache_size, configuration.blob_cache_missing_ttl)
+        self.__parse_cache = ParseResultCache(pathlib.Path(configuration.dir_data, 'parsed'), configuration.parse_cache_size)
+        self.__batch_sizer = AdaptiveBatchSize(configuration.batch_max_items, configuration.batch_max_bytes,
+                                               configuration.batch_flush_seconds)
+        self.__send_window = AimdWindow(configuration.send_window_max)
+        self.__encryption_executor: Optional[Executor] = None
+        if configuration.encryption_processes > 0:
+            self.__encryption_executor = ProcessPoolExecutor(max_workers=configuration.encryption_processes)
+        bytecode_path: Optional[pathlib.Path] = None
+        if configuration.mapper_bytecode_cache:
+            bytecode_path = pathlib.Path(configuration.dir_data, 'mappers')
+        self.__mapper_cache = MapperCache(configuration.mapper_cache_size, bytecode_path)
+        self.__mapper_pool: Optional[MapperProcessPool] = None
+        mapper_processes = configuration.mapper_processes
+        if mapper_processes is None:
+            mapper_processes = os.cpu_count() or 1
+        if mapper_processes > 0:
+            self.__mapper_pool = MapperProcessPool(mapper_processes, configuration.mapper_batch_items,
+                                                   configuration.mapper_cpu_budget, configuration.mapper_timeout,
+                                                   bytecode_path, self.__mapper_cache)
 
     @property
     def bus_connector(self):
@@ -35,6 +65,40 @@ class DatasourceMapperContext(MilleGrillesBusContext):
     def file_handler(self, value: AttachedFileInterface):
         self.__file_handler = value
 
+    @property
+    def key_cache(self) -> DecryptedKeyCache:
+        return self.__key_cache
+
+    @property
+    def blob_cache(self) -> BlobCache:
+        return self.__blob_cache
+
+    @property
+    def parse_cache(self) -> ParseResultCache:
+        return self.__parse_cache
+
+    @property
+    def batch_sizer(self) -> AdaptiveBatchSize:
+        return self.__batch_sizer
+
+    @property
+    def send_window(self) -> AimdWindow:
+        return self.__send_window
+
+    @property
+    def encryption_executor(self) -> Optional[Executor]:
+        """ Process pool for batch encryption, None to use the default thread pool. """
+        return self.__encryption_executor
+
+    @property
+    def mapper_cache(self) -> MapperCache:
+        return self.__mapper_cache
+
+    @property
+    def mapper_pool(self) -> Optional[MapperProcessPool]:
+        """ Worker processes for the python_custom mappers, None to run them on the event loop. """
+        return self.__mapper_pool
+
     async def get_producer(self):
         return await self.__bus_connector.get_producer()
 
@@ -1,13 +1,22 @@
-import binascii
 import datetime
+import email.utils
+import functools
 import json
 import math
+import xml.etree.ElementTree as ET
 
-from typing import Optional, TypedDict, Union
+from typing import Iterable, Iterator, Optional, TypedDict, Union
 
 from millegrilles_messages.messages.Hachage import hacher_to_digest
 
 
+# Same output as json.dumps(value, sort_keys=True) without building an encoder on each call
+_CANONICAL_ENCODER = json.JSONEncoder(sort_keys=True)
+
+# Fields included in the data_id
+_IDENTITY_FIELDS = frozenset(['label', 'date', 'data_str', 'data_number'])
+
+
 def hash_to_id(value: Union[str, dict, list]) -> str:
     """
     Creates a unique id from a value.
@@ -15,18 +24,70 @@ def hash_to_id(value: Union[str, dict, list]) -> str:
     :return: String digest
     """
     if isinstance(value, dict) or isinstance(value, list):
-        value = json.dumps(value, sort_keys=True)
+        value = _CANONICAL_ENCODER.encode(value)
     digest_value = hacher_to_digest(value, 'blake2s-256')
-    return binascii.hexlify(digest_value).decode('utf-8')
+    return digest_value.hex()
+
+
+def group_to_id(group: dict) -> str:
+    """ Id of a group, computed from its current content. """
+    return hash_to_id(group)
 
 
-class DatedItemData:
+class DatedItemBase:
+    """ Behaviour shared by the dated item classes. Declares no storage, subclasses choose dict or slots. """
+
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        if name in _IDENTITY_FIELDS:
+            object.__setattr__(self, '_data_id', None)  # Invalidate
+        object.__setattr__(self, name, value)
+
+    @property
+    def data_id(self):
+        """ Computed on first access. The data_str and data_number dicts must not be modified afterwards. """
+        data_id = self._data_id
+        if data_id is None:
+            items = [self.label, self.date, self.data_str, self.data_number]
+            data_id = hash_to_id(items)
+            object.__setattr__(self, '_data_id', data_id)
+        return data_id
+
+    @property
+    def group_id(self) -> Optional[str]:
+        return None
+
+    def get_cleartext(self) -> dict:
+        return {
+            'label': self.label,
+            'date': self.date,
+            'data_str': self.data_str,
+            'data_number': self.data_number,
+            'urls': self.associated_urls,
+        }
+
+    def to_dict(self) -> dict:
+        """ Serializable form of the item, used to transfer it between processes. """
+        return {
+            'type': 'dated',
+            'label': self.label,
+            'date': self.date,
+            'data_str': self.data_str,
+            'data_number': self.data_number,
+            'associated_urls': self.associated_urls,
+        }
+
+
+class DatedItemData(DatedItemBase):
     """ Item with data associated to a specific date, for example a publication date. """
 
     def __init__(self, label: str, date: int,
                  data_str: Optional[dict[str, str]] = None,
                  data_number: Optional[dict[str, Union[int, float]]] = None,
                  associated_urls: Optional[dict[str, str]] = None):
+        self._data_id: Optional[str] = None
+
         self.label = label
         """ Item label. This can be a title or short description """
 
@@ -45,20 +106,6 @@ class DatedItemData:
         Examples of url content type: main, article, picture, video, reference, footnote. 
         """
 
-    @property
-    def data_id(self):
-        items = [self.label, self.date, self.data_str, self.data_number]
-        return hash_to_id(items)
-
-    def get_cleartext(self) -> dict:
-        return {
-            'label': self.label,
-            'date': self.date,
-            'data_str': self.data_str,
-            'data_number': self.data_number,
-            'urls': self.associated_urls,
-        }
-
 
 class GroupData(TypedDict):
     label: Optional[str]
@@ -71,19 +118,307 @@ class GroupData(TypedDict):
     """ Other group attributes """
 
 
-class GroupedDatedItemData(DatedItemData):
+class GroupedItemMixin:
+    """ Adds the group to the cleartext and serialized forms of an item. """
+
+    __slots__ = ()
+
+    @property
+    def group_id(self) -> str:
+        return group_to_id(self.group)
+
+    def get_cleartext(self) -> dict:
+        item = super().get_cleartext()
+        item['group'] = self.group
+        return item
+
+    def to_dict(self) -> dict:
+        value = super().to_dict()
+        value['type'] = 'grouped'
+        value['group'] = self.group
+        return value
+
+
+class GroupedDatedItemData(GroupedItemMixin, DatedItemData):
     """ Item associated to a date and grouped with other items. """
 
     def __init__(self, label: str, date: int, group: GroupData):
         super().__init__(label, date)
         self.group = group
 
+
+class CompactDatedItemData(DatedItemBase):
+    """ DatedItemData without a per-instance dict, for mappers producing many items. """
+
+    __slots__ = ('_data_id', 'label', 'date', 'data_str', 'data_number', 'associated_urls')
+
+    def __init__(self, label: str, date: int,
+                 data_str: Optional[dict[str, str]] = None,
+                 data_number: Optional[dict[str, Union[int, float]]] = None,
+                 associated_urls: Optional[dict[str, str]] = None):
+        self._data_id: Optional[str] = None
+        self.label = label
+        self.date = date
+        self.data_str = data_str
+        self.data_number = data_number
+        self.associated_urls = associated_urls
+
+
+class CompactGroupedDatedItemData(GroupedItemMixin, CompactDatedItemData):
+    """ GroupedDatedItemData without a per-instance dict. """
+
+    __slots__ = ('group',)
+
+    def __init__(self, label: str, date: int, group: GroupData,
+                 data_str: Optional[dict[str, str]] = None,
+                 data_number: Optional[dict[str, Union[int, float]]] = None,
+                 associated_urls: Optional[dict[str, str]] = None):
+        super().__init__(label, date, data_str, data_number, associated_urls)
+        self.group = group
+
+
+class DatedItemRow:
+    """ View of one row of a DatedItemBatch, with the same interface as DatedItemData. """
+
+    __slots__ = ('_batch', '_index')
+
+    def __init__(self, batch: 'DatedItemBatch', index: int):
+        self._batch = batch
+        self._index = index
+
+    label = property(lambda self: self._batch.labels[self._index])
+    date = property(lambda self: self._batch.dates[self._index])
+    data_str = property(lambda self: self._batch.data_str[self._index])
+    data_number = property(lambda self: self._batch.data_number[self._index])
+    associated_urls = property(lambda self: self._batch.associated_urls[self._index])
+    group = property(lambda self: self._batch.groups[self._index])
+
+    @property
+    def data_id(self) -> str:
+        return self._batch.get_data_id(self._index)
+
+    @property
+    def group_id(self) -> Optional[str]:
+        return self._batch.get_group_id(self._index)
+
     def get_cleartext(self) -> dict:
-        item = super().get_cleartext()
-        item['group'] = self.group
+        return self._batch.get_cleartext(self._index)
+
+
+class DatedItemBatch:
+    """
+    Columnar container of items, yielded once by mappers producing many items. Values are kept in
+    parallel lists, groups are shared references. Iterating gives a DatedItemRow for each item.
+    Group ids are memoized for the groups shared by the items of the batch.
+    """
+
+    __slots__ = ('labels', 'dates', 'data_str', 'data_number', 'associated_urls', 'groups', '_data_ids', '_group_ids')
+
+    def __init__(self):
+        self.labels: list[str] = list()
+        self.dates: list[int] = list()
+        self.data_str: list[Optional[dict[str, str]]] = list()
+        self.data_number: list[Optional[dict[str, Union[int, float]]]] = list()
+        self.associated_urls: list[Optional[dict[str, str]]] = list()
+        self.groups: list[Optional[GroupData]] = list()
+        self._data_ids: list[Optional[str]] = list()
+        self._group_ids: dict[int, str] = dict()  # id(group): group_id, the groups are referenced by the batch
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __iter__(self):
+        for index in range(len(self.labels)):
+            yield DatedItemRow(self, index)
+
+    def append(self, label: str, date: int,
+               data_str: Optional[dict[str, str]] = None,
+               data_number: Optional[dict[str, Union[int, float]]] = None,
+               associated_urls: Optional[dict[str, str]] = None,
+               group: Optional[GroupData] = None):
+        self.labels.append(label)
+        self.dates.append(date)
+        self.data_str.append(data_str)
+        self.data_number.append(data_number)
+        self.associated_urls.append(associated_urls)
+        self.groups.append(group)
+        self._data_ids.append(None)
+
+    def get_data_id(self, index: int) -> str:
+        data_id = self._data_ids[index]
+        if data_id is None:
+            items = [self.labels[index], self.dates[index], self.data_str[index], self.data_number[index]]
+            data_id = hash_to_id(items)
+            self._data_ids[index] = data_id
+        return data_id
+
+    def get_group_id(self, index: int) -> Optional[str]:
+        group = self.groups[index]
+        if group is None:
+            return None
+        try:
+            return self._group_ids[id(group)]
+        except KeyError:
+            group_id = group_to_id(group)
+            self._group_ids[id(group)] = group_id
+            return group_id
+
+    def get_cleartext(self, index: int) -> dict:
+        item = {
+            'label': self.labels[index],
+            'date': self.dates[index],
+            'data_str': self.data_str[index],
+            'data_number': self.data_number[index],
+            'urls': self.associated_urls[index],
+        }
+        group = self.groups[index]
+        if group is not None:
+            item['group'] = group
         return item
 
+    def to_dict(self) -> dict:
+        return {
+            'type': 'batch',
+            'labels': self.labels,
+            'dates': self.dates,
+            'data_str': self.data_str,
+            'data_number': self.data_number,
+            'associated_urls': self.associated_urls,
+            'groups': self.groups,
+        }
+
+
+def item_from_dict(value: dict) -> Union[DatedItemBase, DatedItemBatch]:
+    """ Restores an item serialized with to_dict(). """
+    item_type = value['type']
+    if item_type == 'grouped':
+        return CompactGroupedDatedItemData(value['label'], value['date'], value['group'], value['data_str'],
+                                           value['data_number'], value['associated_urls'])
+    elif item_type == 'dated':
+        return CompactDatedItemData(value['label'], value['date'], value['data_str'],
+                                    value['data_number'], value['associated_urls'])
+    elif item_type == 'batch':
+        batch = DatedItemBatch()
+        batch.labels = value['labels']
+        batch.dates = value['dates']
+        batch.data_str = value['data_str']
+        batch.data_number = value['data_number']
+        batch.associated_urls = value['associated_urls']
+        batch.groups = value['groups']
+        batch._data_ids = [None] * len(batch.labels)
+        batch._group_ids = dict()
+        return batch
+    else:
+        raise TypeError('Unsupported item type %s' % item_type)
+
+
+CONST_DATE_CACHE_SIZE = 4096
+
+
+def _to_epoch(value: datetime.datetime) -> int:
+    return math.floor(value.timestamp())  # Dates without timezone are in local time
+
+
+def parse_date_epoch(date_str: str, formats: Union[str, Iterable[str], None] = None) -> int:
+    """
+    Parses a date to epoch seconds. RFC 822 (RSS pubDate, e.g. "Sat, 17 May 2025 10:09:19 -0400")
+    and ISO 8601 (Atom updated, dc:date, e.g. "2025-05-17T10:09:19Z") dates are detected.
+    Results are memoized, feeds repeat the same dates a lot.
+    :param date_str: Date to parse
+    :param formats: Other strptime formats to try first (a format or a list), for sites with a custom date format
+    :return: Epoch seconds
+    :raises ValueError: When the date cannot be parsed
+    """
+    if isinstance(formats, str):
+        formats = (formats,)
+    elif formats is not None:
+        formats = tuple(formats)  # Hashable for the cache
+    return _parse_date_epoch(date_str, formats)
+
+
+@functools.lru_cache(maxsize=CONST_DATE_CACHE_SIZE)
+def _parse_date_epoch(date_str: str, formats: Optional[tuple[str, ...]]) -> int:
+    value = date_str.strip()
+
+    if formats is not None:
+        for date_format in formats:
+            try:
+                return _to_epoch(datetime.datetime.strptime(value, date_format))
+            except ValueError:
+                pass
+
+    if len(value) >= 10 and value[4] == '-' and value[:4].isdigit():
+        return _to_epoch(datetime.datetime.fromisoformat(value))
+
+    value = email.utils.parsedate_to_datetime(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)  # -0000 (RFC 2822), UTC without a known offset
+    return _to_epoch(value)
+
 
 def parse_date(date_str: str) -> int:
-    parsed_date = datetime.datetime.strptime(date_str, '%a, %d %b %Y %H:%M:%S %z')
-    return math.floor(parsed_date.timestamp())
+    return parse_date_epoch(date_str)
+
+
+# Namespace prefixes known by iter_xml_items, in addition to the ones provided by the mapper
+XML_NAMESPACES = {
+    'atom': 'http://www.w3.org/2005/Atom',
+    'rss1': 'http://purl.org/rss/1.0/',
+}
+# RSS 2.0 item, Atom entry and RSS 1.0 (RDF) item
+XML_ITEM_TAGS = ('item', 'atom:entry', 'rss1:item')
+CONST_XML_CHUNK_SIZE = 64 * 1024
+
+
+def _qualify_tag(tag: str, namespaces: dict[str, str]) -> str:
+    """ Converts prefix:name (or name with a default '' namespace) to {uri}name, like ElementTree.find. """
+    if tag.startswith('{'):
+        return tag
+    if ':' in tag:
+        prefix, name = tag.split(':', 1)
+        return '{%s}%s' % (namespaces[prefix], name)
+    default_namespace = namespaces.get('')
+    if default_namespace:
+        return '{%s}%s' % (default_namespace, tag)
+    return tag
+
+
+def iter_xml_items(data: Union[str, bytes], tags: Union[str, Iterable[str]] = XML_ITEM_TAGS,
+                   namespaces: Optional[dict[str, str]] = None,
+                   chunk_size: int = CONST_XML_CHUNK_SIZE) -> Iterator[ET.Element]:
+    """
+    Parses an XML document incrementally and yields the item elements one at a time, without building
+    the whole tree. Each element is cleared and removed from its parent once the next one is requested.
+    :param data: XML document
+    :param tags: Item tags, as name, prefix:name or {uri}name. Defaults to RSS items and Atom entries.
+    :param namespaces: Prefixes used in tags, same format as for ElementTree.find
+    :param chunk_size: Size of the chunks fed to the parser
+    :raises ET.ParseError: When the document is not valid, possibly after some items were yielded
+    """
+    all_namespaces = dict(XML_NAMESPACES)
+    if namespaces is not None:
+        all_namespaces.update(namespaces)
+    if isinstance(tags, str):
+        tags = [tags]
+    item_tags = {_qualify_tag(tag, all_namespaces) for tag in tags}
+
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    parents: list[ET.Element] = list()
+
+    def read_items():
+        for event, element in parser.read_events():
+            if event == 'start':
+                parents.append(element)
+                continue
+            parents.pop()
+            if element.tag in item_tags:
+                yield element
+                element.clear()
+                if len(parents) > 0:
+                    parents[-1].remove(element)
+
+    for offset in range(0, len(data), chunk_size):
+        parser.feed(data[offset:offset + chunk_size])
+        yield from read_items()
+    parser.close()
+    yield from read_items()
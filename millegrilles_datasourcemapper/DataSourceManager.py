@@ -41,6 +41,11 @@ class DatasourceManager:
     async def __maintain_datasources_thread(self):
         while self.__context.stopping is False:
             await self.__maintain_staging()
+            self.__logger.debug("Decrypted key cache: %s", self.__context.key_cache.stats)
+            self.__logger.debug("Blob cache: %s", self.__context.blob_cache.stats)
+            self.__logger.debug("Parse result cache: %s", self.__context.parse_cache.stats)
+            self.__logger.debug("Feed view workers: %s", self.__feed_view_processor.stats)
+            self.__logger.debug("Mapper cache: %s", self.__context.mapper_cache.stats)
             await self.__context.wait(300)
 
     async def __maintain_staging(self):
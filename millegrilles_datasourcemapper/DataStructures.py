@@ -1,7 +1,8 @@
 import datetime
 import pathlib
+import time
 
-from typing import Optional, TypedDict, Union
+from typing import AsyncIterator, Awaitable, Callable, Optional, TypedDict, Union
 
 from millegrilles_messages.messages.MessagesModule import MessageWrapper
 
@@ -25,6 +26,14 @@ class AttachedFileInterface:
         """
         raise NotImplementedError('interface method - must override')
 
+    def iter_download_file(self, fuuid: str) -> AsyncIterator[bytes]:
+        """
+        Downloads a file without decrypting it, yielding the content as it is received.
+        :param fuuid:
+        :return: Async iterator of file content chunks
+        """
+        raise NotImplementedError('interface method - must override')
+
     async def download_file(self, fuuid: str, fp) -> int:
         """
         Downloads a file without decrypting it.
@@ -147,6 +156,12 @@ class Filehost:
         return filehost
 
 
+# Process job priority classes, lowest value first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_UPDATE = 1
+PRIORITY_BULK = 2
+
+
 class ProcessJob:
 
     def __init__(self, message: MessageWrapper):
@@ -158,7 +173,21 @@ class ProcessJob:
         self.encryption_key_id: Optional[str] = None
         self.encryption_key_str: Optional[str] = None
         self.encryption_key: Optional[bytes] = None
-        self.data_file_path: Optional[pathlib.Path] = None
+        self.feed_staging = None
+        """ FeedStaging of the feed, set by the download """
+        self.staging_paths: Optional[list[pathlib.Path]] = None
+        """ Staged segments to process for the view """
+        self.staging_after: Optional[dict] = None
+        """ Cursor (save_date, data_id) of the data the view already processed """
+        self.schedule_key = None
+        """ Set by the scheduler, identifies the triggers merged into this job """
+        self.priority = PRIORITY_UPDATE
+        self.triggered = time.monotonic()
+        """ Time of the latest trigger merged into this job """
+        self.data_cutoff: Optional[float] = None
+        """ Set by the download, the feed data saved before this time (monotonic) is staged """
+        self.yield_point: Optional[Callable[[], Awaitable[None]]] = None
+        """ Set by the worker, awaited by long running jobs between batches """
 
     def __copy__(self):
         job = ProcessJob(self.message)
@@ -169,7 +198,14 @@ class ProcessJob:
         job.encryption_key_id = self.encryption_key_id
         job.encryption_key_str = self.encryption_key_str
         job.encryption_key = self.encryption_key
-        job.data_file_path = self.data_file_path
+        job.feed_staging = self.feed_staging
+        job.staging_paths = self.staging_paths
+        job.staging_after = self.staging_after
+        job.schedule_key = self.schedule_key
+        job.priority = self.priority
+        job.triggered = self.triggered
+        job.data_cutoff = self.data_cutoff
+        job.yield_point = self.yield_point
         return job
 
     def copy(self):
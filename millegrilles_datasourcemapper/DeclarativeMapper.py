@@ -0,0 +1,380 @@
+import functools
+import html
+import json
+import re
+import xml.etree.ElementTree as ET
+
+from typing import Any, Callable, Iterator, Optional, Union
+
+from millegrilles_datasourcemapper.DataParserUtilities import DatedItemBatch, GroupData, XML_NAMESPACES, \
+    _qualify_tag, iter_xml_items, parse_date_epoch
+from millegrilles_datasourcemapper.MapperCache import hash_mapping_code
+from millegrilles_datasourcemapper.RssParser import iter_feed_entries
+
+# Declarative mappings describe where the item values are found and how they are transformed. They are compiled once
+# to extractor functions, no code is executed. Example of a view mapping_declarative:
+#
+# {
+#     "format": "rss",                  # rss (RSS/Atom entries, feedparser keys), xml or json
+#     "items": "item",                  # xml: item tag, json: path to the list of items. Not used for rss.
+#     "namespaces": {"ht": "https://trends.google.com/trending/rss"},
+#     "label": {"path": "title", "transforms": ["html_text"]},
+#     "date": {"path": ["published", "updated"], "transforms": ["date"]},
+#     "data_str": {"summary": {"path": "summary", "transforms": ["html_text"]}, "keywords": "tags.*.term"},
+#     "data_number": {"comments": {"path": "slash:comments", "transforms": ["int"]}},
+#     "urls": {"main": "link", "picture": ["media_thumbnail.0.url", "media_content.0.url"]},
+#     "group": {                        # Optional, xml and json only. The items above become groups.
+#         "items": "ht:news_item",      # Path of the grouped items in a group
+#         "label": "title", "pub_date": {"path": "pubDate", "transforms": ["date"]}, "other": {}
+#     }
+# }
+#
+# Paths: rss and json use dotted keys with list indexes and * to collect all values (e.g. tags.*.term).
+# xml uses ElementTree paths with namespace prefixes, @attr for an attribute (e.g. atom:link@href), ending with *
+# to collect all matches. A list of paths gives the first non-empty value.
+# When group is set, a field with "from": "group" is read from the group element.
+# Lists collected with * are joined with ', ' in data_str and reduced to their first value in data_number.
+# Dates are epoch seconds, date strings are parsed when the date has no date transform. data_number values are
+# converted to numbers. An item is skipped when its label or date is missing or can't be transformed
+# (e.g. unparseable date), an optional value that can't be transformed is left out.
+
+FORMATS = ('rss', 'xml', 'json')
+TRANSFORM_ERRORS = (ValueError, TypeError, AttributeError, OverflowError)
+RE_TAGS = re.compile(r'<[^>]+>')
+
+Getter = Callable[[Any], Any]
+Extractor = Callable[[Any, Any], Any]
+
+
+class DeclarativeMappingError(ValueError):
+    pass
+
+
+def _strip_tags(value):
+    return RE_TAGS.sub('', value)
+
+
+def _join(value):
+    if isinstance(value, list):
+        return ', '.join(str(v) for v in value if v is not None)
+    return value
+
+
+def _first(value):
+    if isinstance(value, list):
+        return value[0] if len(value) > 0 else None
+    return value
+
+
+def _int(value):
+    return int(str(value).strip().replace(',', ''))
+
+
+def _float(value):
+    return float(str(value).strip().replace(',', ''))
+
+
+def _number(value) -> Union[int, float]:
+    """ data_number values, numeric strings are converted. """
+    if isinstance(value, bool):
+        raise TypeError('Not a number: %s' % value)
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return _int(value)
+    except ValueError:
+        return _float(value)
+
+
+def _date(value) -> int:
+    """ Item date in epoch seconds, date strings without a date transform are parsed. """
+    value = _first(value)
+    if isinstance(value, str):
+        value = parse_date_epoch(value)
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise TypeError('Invalid date: %s' % value)
+    return int(value)
+
+
+TRANSFORMS: dict[str, Callable[[Any], Any]] = {
+    'strip': lambda v: v.strip(),
+    'strip_tags': _strip_tags,
+    'unescape': html.unescape,
+    'html_text': lambda v: html.unescape(_strip_tags(v)).strip(),
+    'lower': lambda v: v.lower(),
+    'upper': lambda v: v.upper(),
+    'date': parse_date_epoch,
+    'int': _int,
+    'float': _float,
+    'join': _join,
+    'first': _first,
+}
+
+
+def _compile_transform(name: str) -> Callable[[Any], Any]:
+    if name.startswith('truncate:'):
+        length = int(name[len('truncate:'):])
+        return lambda v: v[:length]
+    if name.startswith('prefix:'):
+        prefix = name[len('prefix:'):]
+        return lambda v: prefix + v
+    try:
+        return TRANSFORMS[name]
+    except KeyError:
+        raise DeclarativeMappingError('Unknown transform %s' % name)
+
+
+def _apply(transform: Callable[[Any], Any], value):
+    """ Applies a transform to a value, element by element for lists. None values are kept. """
+    if value is None:
+        return None
+    if isinstance(value, list) and transform not in (_join, _first):
+        return [transform(v) for v in value if v is not None]
+    return transform(value)
+
+
+def _compile_dict_path(path: str) -> Getter:
+    tokens = [int(t) if t.isdigit() else t for t in path.split('.')]
+
+    def get(value, position=0):
+        for index in range(position, len(tokens)):
+            token = tokens[index]
+            if value is None:
+                return None
+            if token == '*':
+                if not isinstance(value, list):
+                    value = [value]
+                return [get(v, index + 1) for v in value]
+            try:
+                value = value[token]
+            except (KeyError, IndexError, TypeError):
+                return None
+        return value
+
+    return get
+
+
+def _compile_xml_path(path: str, namespaces: dict[str, str]) -> Getter:
+    collect_all = path.endswith('*') and not path.endswith('/*')
+    if collect_all:
+        path = path[:-1]
+    attribute = None
+    if '@' in path:
+        path, attribute = path.split('@', 1)
+        attribute = _qualify_tag(attribute, {k: v for (k, v) in namespaces.items() if k != ''})
+    path = path.rstrip('/') or '.'
+
+    def read(element: ET.Element):
+        if attribute is not None:
+            value = element.get(attribute)
+        else:
+            value = element.text
+        if value is not None:
+            value = value.strip()
+        return value
+
+    if collect_all:
+        return lambda element: [read(e) for e in element.findall(path, namespaces)]
+
+    def get(element: ET.Element):
+        found = element if path == '.' else element.find(path, namespaces)
+        if found is None:
+            return None
+        return read(found)
+
+    return get
+
+
+def _compile_field(spec: Union[str, list, dict], compile_path: Callable[[str], Getter], grouped: bool) -> Extractor:
+    """ :return: Extractor function (item, group) -> value """
+    if isinstance(spec, (str, list)):
+        spec = {'path': spec}
+    if not isinstance(spec, dict) or 'path' not in spec:
+        raise DeclarativeMappingError('Invalid field %s' % spec)
+
+    paths = spec['path'] if isinstance(spec['path'], list) else [spec['path']]
+    getters = [compile_path(p) for p in paths]
+    transforms = [_compile_transform(t) for t in spec.get('transforms', list())]
+    default = spec.get('default')
+    from_group = spec.get('from') == 'group'
+    if from_group and not grouped:
+        raise DeclarativeMappingError('Field %s reads from the group but no group is defined' % spec)
+
+    def extract(item, group=None):
+        source = group if from_group else item
+        value = None
+        for getter in getters:
+            value = getter(source)
+            if value is not None and value != '' and value != []:
+                break
+        for transform in transforms:
+            value = _apply(transform, value)
+        if value is None:
+            return default
+        return value
+
+    return extract
+
+
+class CompiledMapping:
+    """ Declarative mapping compiled to extractor functions. """
+
+    def __init__(self, mapping: dict):
+        self.__format = mapping.get('format', 'rss')
+        if self.__format not in FORMATS:
+            raise DeclarativeMappingError('Unknown format %s' % self.__format)
+
+        namespaces = dict(XML_NAMESPACES)
+        namespaces.update(mapping.get('namespaces') or dict())
+        self.__namespaces = namespaces
+        self.__items_path: Optional[str] = mapping.get('items')
+        if self.__format == 'json' and self.__items_path is not None:
+            self.__items_getter = _compile_dict_path(self.__items_path)
+
+        group = mapping.get('group')
+        grouped = group is not None
+        if grouped and self.__format == 'rss':
+            raise DeclarativeMappingError('Groups are only supported for the xml and json formats')
+
+        if self.__format == 'xml':
+            compile_path = functools.partial(_compile_xml_path, namespaces=namespaces)
+        else:
+            compile_path = _compile_dict_path
+
+        try:
+            self.__label = _compile_field(mapping['label'], compile_path, grouped)
+            self.__date = _compile_field(mapping['date'], compile_path, grouped)
+        except KeyError as e:
+            raise DeclarativeMappingError('Missing mandatory field %s' % e)
+        self.__data_str = [(k, _compile_field(v, compile_path, grouped)) for (k, v) in (mapping.get('data_str') or dict()).items()]
+        self.__data_number = [(k, _compile_field(v, compile_path, grouped)) for (k, v) in (mapping.get('data_number') or dict()).items()]
+        self.__urls = [(k, _compile_field(v, compile_path, grouped)) for (k, v) in (mapping.get('urls') or dict()).items()]
+
+        self.__group_items: Optional[Getter] = None
+        if grouped:
+            try:
+                group_items_path = group['items']
+            except KeyError:
+                raise DeclarativeMappingError('Missing group items path')
+            if self.__format == 'xml':
+                self.__group_items = functools.partial(_find_all, path=group_items_path, namespaces=namespaces)
+            else:
+                self.__group_items = _compile_dict_path(group_items_path)
+            self.__group_label = _compile_field(group.get('label', {'path': '__none__'}), compile_path, False)
+            self.__group_pub_date = _compile_field(group.get('pub_date', {'path': '__none__'}), compile_path, False)
+            self.__group_other = [(k, _compile_field(v, compile_path, False)) for (k, v) in (group.get('other') or dict()).items()]
+
+    def parse(self, data: str) -> DatedItemBatch:
+        """ Maps all the items of a data item. Items without label or date are skipped. """
+        batch = DatedItemBatch()
+        for source in self.__iter_sources(data):
+            if self.__group_items is None:
+                self.__add_item(batch, source, None, None)
+                continue
+
+            group_data = GroupData(label=self.__group_label(source),
+                                   pub_date=self.__group_pub_date(source),
+                                   other={k: e(source) for (k, e) in self.__group_other} or None)
+            for child in self.__group_items(source) or list():
+                self.__add_item(batch, child, source, group_data)
+        return batch
+
+    def __iter_sources(self, data: str) -> Iterator:
+        if self.__format == 'rss':
+            return iter_feed_entries(data)
+        elif self.__format == 'xml':
+            if self.__items_path is None:
+                return iter_xml_items(data)
+            return iter_xml_items(data, self.__items_path, self.__namespaces)
+        else:
+            value = json.loads(data)
+            if self.__items_path is not None:
+                value = self.__items_getter(value)
+            if value is None:
+                return iter(list())
+            if not isinstance(value, list):
+                value = [value]
+            return iter(value)
+
+    def __add_item(self, batch: DatedItemBatch, source, group_source, group_data: Optional[GroupData]):
+        try:
+            label = self.__label(source, group_source)
+            date = self.__date(source, group_source)
+            if not label or date is None:
+                return  # Mandatory values missing
+            date = _date(date)
+        except TRANSFORM_ERRORS:
+            return  # Invalid mandatory value
+
+        data_str = _collect(self.__data_str, source, group_source, _join)
+        data_number = _collect(self.__data_number, source, group_source, _first, _number)
+
+        associated_urls = None
+        for (url_type, extract) in self.__urls:
+            try:
+                urls = extract(source, group_source)
+            except TRANSFORM_ERRORS:
+                continue
+            if not urls:
+                continue
+            if associated_urls is None:
+                associated_urls = dict()
+            for url in (urls if isinstance(urls, list) else [urls]):
+                if url:
+                    associated_urls[url] = url_type
+
+        batch.append(_first(label) if isinstance(label, list) else label, date,
+                     data_str, data_number, associated_urls, group_data)
+
+
+def _find_all(element: ET.Element, path: str, namespaces: dict[str, str]) -> list[ET.Element]:
+    return element.findall(path, namespaces)
+
+
+def _collect(extractors: list[tuple[str, Extractor]], source, group_source,
+             reduce_list: Callable[[list], Any], convert: Optional[Callable[[Any], Any]] = None) -> Optional[dict]:
+    """
+    :param reduce_list: Maps list values to a single value
+    :param convert: Converts the values, a value that can't be converted is left out
+    """
+    values = None
+    for (key, extract) in extractors:
+        try:
+            value = extract(source, group_source)
+            if isinstance(value, list):
+                value = reduce_list(value)
+            if value is not None and convert is not None:
+                value = convert(value)
+        except TRANSFORM_ERRORS:
+            continue  # Optional value left out
+        if value is not None:
+            if values is None:
+                values = dict()
+            values[key] = value
+    return values
+
+
+def hash_mapping(mapping: Union[str, dict]) -> str:
+    """ Hash of the mapping content, key formatting is ignored for dicts. """
+    if isinstance(mapping, dict):
+        mapping = json.dumps(mapping, sort_keys=True)
+    return hash_mapping_code(mapping)
+
+
+@functools.lru_cache(maxsize=64)
+def _compile_mapping_str(mapping: str) -> CompiledMapping:
+    return CompiledMapping(json.loads(mapping))
+
+
+def compile_mapping(mapping: Union[str, dict]) -> CompiledMapping:
+    """
+    Compiles a declarative mapping, memoized by content.
+    :param mapping: Mapping as dict or json string
+    :raises DeclarativeMappingError: When the mapping is invalid
+    """
+    if isinstance(mapping, dict):
+        mapping = json.dumps(mapping, sort_keys=True)
+    try:
+        return _compile_mapping_str(mapping)
+    except json.JSONDecodeError as e:
+        raise DeclarativeMappingError('Invalid mapping json: %s' % e)
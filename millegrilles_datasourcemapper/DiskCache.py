@@ -0,0 +1,237 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import tempfile
+import time
+import zlib
+
+from collections import OrderedDict
+from importlib import metadata
+from typing import Optional
+
+# Increment when the parsing library (DataParserUtilities, RssParser, bundled mappers) changes the parsed items,
+# cached parse results of previous versions are not used. The installed package version is also part of the key.
+PARSE_CACHE_VERSION = 1
+
+
+def _package_version() -> str:
+    try:
+        return metadata.version('millegrilles_datasourcemapper')
+    except metadata.PackageNotFoundError:
+        return 'dev'
+
+
+class LruDirectoryCache:
+    """
+    Size-bounded directory of files. The least recently used files are evicted first.
+    The file modification time is used to restore the usage order on restart.
+    """
+
+    def __init__(self, path: pathlib.Path, max_size: int):
+        self.__logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self._path = path
+        self.__max_size = max_size
+        self.__entries: OrderedDict[str, int] = OrderedDict()  # key: file size
+        self.__size = 0
+        self.__hits = 0
+        self.__misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.__max_size > 0
+
+    @property
+    def stats(self) -> dict:
+        requests = self.__hits + self.__misses
+        hit_rate = self.__hits / requests if requests > 0 else None
+        return {'hits': self.__hits, 'misses': self.__misses, 'hit_rate': hit_rate,
+                'count': len(self.__entries), 'size': self.__size}
+
+    def load(self):
+        """ Scans the cache directory. Blocking, run in a thread. """
+        if self.enabled is False:
+            return
+        self._path.mkdir(parents=True, exist_ok=True)
+
+        files = list()
+        for entry in os.scandir(self._path):
+            if entry.is_file() and self._is_entry(entry.name):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name, stat.st_size))
+            elif entry.is_file() and entry.name.startswith('.tmp'):
+                os.unlink(entry.path)  # Leftover from an interrupted write
+
+        self.__entries.clear()
+        self.__size = 0
+        for (_mtime, key, size) in sorted(files):
+            self.__entries[key] = size
+            self.__size += size
+
+        self.__evict()
+        self.__logger.info("Loaded %d entries (%d bytes) from %s", len(self.__entries), self.__size, self._path)
+
+    def get(self, key: str) -> Optional[pathlib.Path]:
+        """
+        :param key: Entry key
+        :return: Path of the cached file or None when absent
+        """
+        if key not in self.__entries:
+            self.__misses += 1
+            return None
+
+        path = self._path / key
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self.__discard(key)
+            self.__misses += 1
+            return None
+
+        self.__entries.move_to_end(key)
+        self.__hits += 1
+        return path
+
+    def open_temporary(self):
+        """ :return: Temporary file in the cache directory, pass it to commit() once fully written. """
+        return tempfile.NamedTemporaryFile('wb', dir=self._path, prefix='.tmp', delete=False)
+
+    def commit(self, key: str, temp_path: str):
+        """ Moves a completed temporary file into the cache. """
+        size = os.stat(temp_path).st_size
+        os.replace(temp_path, self._path / key)
+        self.__discard(key)
+        self.__entries[key] = size
+        self.__size += size
+        self.__evict()
+
+    def put(self, key: str, content: bytes):
+        with self.open_temporary() as temp_file:
+            temp_file.write(content)
+        self.commit(key, temp_file.name)
+
+    def remove(self, key: str):
+        try:
+            os.unlink(self._path / key)
+        except FileNotFoundError:
+            pass
+        self.__discard(key)
+
+    def clear(self):
+        for key in list(self.__entries.keys()):
+            self.remove(key)
+
+    def _is_entry(self, name: str) -> bool:
+        return not name.startswith('.')
+
+    def __discard(self, key: str):
+        try:
+            self.__size -= self.__entries.pop(key)
+        except KeyError:
+            pass
+
+    def __evict(self):
+        while self.__size > self.__max_size and len(self.__entries) > 0:
+            key, size = self.__entries.popitem(last=False)
+            self.__size -= size
+            try:
+                os.unlink(self._path / key)
+            except FileNotFoundError:
+                pass
+
+
+class BlobCache(LruDirectoryCache):
+    """
+    Local copy of filehost files by fuuid. Fuuids are content hashes, cached files never go stale.
+    Also keeps a negative cache of fuuids that are missing from the filehost.
+    """
+
+    def __init__(self, path: pathlib.Path, max_size: int, missing_ttl: int):
+        super().__init__(path, max_size)
+        self.__logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.__missing_ttl = missing_ttl
+        self.__missing: dict[str, float] = dict()  # fuuid: expiration (epoch seconds)
+        self.__missing_path = path / '.missing.json'
+        self.__missing_lock = asyncio.Lock()
+
+    def load(self):
+        super().load()
+        if self.enabled is False:
+            return
+        try:
+            with open(self.__missing_path) as fp:
+                self.__missing = json.load(fp)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.__missing = dict()
+        self.__expire_missing()
+
+    def is_missing(self, fuuid: str) -> bool:
+        try:
+            expiration = self.__missing[fuuid]
+        except KeyError:
+            return False
+        if expiration < time.time():
+            del self.__missing[fuuid]
+            return False
+        return True
+
+    async def set_missing(self, fuuid: str):
+        if self.enabled is False:
+            return
+        self.__missing[fuuid] = time.time() + self.__missing_ttl
+        self.__expire_missing()
+        # One save at a time, each saves the latest state
+        async with self.__missing_lock:
+            await asyncio.to_thread(self.__save_missing, dict(self.__missing))
+
+    def __save_missing(self, missing: dict[str, float]):
+        """ Blocking, run in a thread. Replaces the file atomically. """
+        temp_path = pathlib.Path(f'{self.__missing_path}.tmp')
+        try:
+            with open(temp_path, 'wt') as fp:
+                json.dump(missing, fp)
+            os.replace(temp_path, self.__missing_path)
+        except OSError:
+            self.__logger.exception("Error saving missing fuuids")
+
+    def __expire_missing(self):
+        now = time.time()
+        for fuuid in [f for (f, expiration) in self.__missing.items() if expiration < now]:
+            del self.__missing[fuuid]
+
+
+class ParseResultCache(LruDirectoryCache):
+    """
+    Items parsed from a data item, serialized with to_dict. Keyed by the hash of the mapping and the hash of
+    the data with the cache and package versions: editing the mapping or upgrading the package changes the key
+    and the stale results age out of the cache.
+    """
+
+    VERSION = '%d:%s' % (PARSE_CACHE_VERSION, _package_version())
+
+    @staticmethod
+    def make_key(mapping_hash: str, data: str) -> str:
+        data_hash = hashlib.blake2s(ParseResultCache.VERSION.encode('utf-8'))
+        data_hash.update(b'\n')
+        data_hash.update(data.encode('utf-8'))
+        return '%s.%s' % (mapping_hash, data_hash.hexdigest())
+
+    @staticmethod
+    def encode_items(items: list[dict]) -> bytes:
+        return zlib.compress(json.dumps(items).encode('utf-8'), 1)
+
+    def read_items(self, path: pathlib.Path) -> Optional[list[dict]]:
+        """ Blocking, run in a thread. :return: Serialized items or None when the file is unreadable """
+        try:
+            with open(path, 'rb') as fp:
+                return json.loads(zlib.decompress(fp.read()))
+        except (OSError, zlib.error, ValueError):
+            return None
+
+    def write_temporary(self, items: list[dict]) -> str:
+        """ Blocking, run in a thread. :return: Temporary file path, pass it to commit() """
+        with self.open_temporary() as temp_file:
+            temp_file.write(self.encode_items(items))
+        return temp_file.name
@@ -1,16 +1,35 @@
 import asyncio
+import collections
 import logging
 import json
-import gzip
+import pathlib
+import random
+import time
 
-from typing import AsyncIterable, Optional
+from typing import AsyncIterable, Awaitable, Callable, Optional, Union
 
+from millegrilles_datasourcemapper.AdaptiveSizing import AimdWindow, estimate_serialized_size
 from millegrilles_datasourcemapper.mappers.WIPMapper import parse as wip_parser
 from millegrilles_messages.chiffrage.Mgs4 import chiffrer_mgs4_bytes_secrete
 from millegrilles_messages.messages import Constantes
 from millegrilles_datasourcemapper.Context import DatasourceMapperContext
-from millegrilles_datasourcemapper.DataParserUtilities import DatedItemData, hash_to_id, GroupedDatedItemData
+from millegrilles_datasourcemapper.DataParserUtilities import DatedItemData, DatedItemBase, DatedItemBatch, \
+    DatedItemRow, item_from_dict
 from millegrilles_datasourcemapper.FeedViewProcessor import ProcessJob
+from millegrilles_datasourcemapper.DeclarativeMapper import CompiledMapping, compile_mapping, hash_mapping
+from millegrilles_datasourcemapper.MapperCache import CompiledMapper, hash_mapping_code
+from millegrilles_datasourcemapper.PublishedIndex import PublishedIdIndex
+from millegrilles_datasourcemapper.FeedStaging import iter_view_records
+
+CONST_PARSED_QUEUE_SIZE = 16  # Parse results waiting to be batched
+CONST_RETRY_DELAY = 1.0  # Seconds before the first retry of a batch, doubles on each attempt
+CONST_RETRY_DELAY_MAX = 30.0
+
+
+class BatchRejectedException(Exception):
+    """ DataCollector answered with an error, the batch is not retried. """
+    pass
+
 
 class FeedDataItem:
 
@@ -20,71 +39,328 @@ class FeedDataItem:
 
     @staticmethod
     def from_str(line: str):
-        value = json.loads(line)
+        return FeedDataItem.from_dict(json.loads(line))
+
+    @staticmethod
+    def from_dict(value: dict):
         data = value['data']
         files = value.get('files')
         return FeedDataItem(data, files)
 
 
+def encrypt_cleartext(encryption_key: bytes, cleartext: list[dict]) -> list[dict]:
+    """ Serializes and encrypts a list of items. Blocking, runs in a thread or process pool. """
+    return [chiffrer_mgs4_bytes_secrete(encryption_key, json.dumps(value))[1] for value in cleartext]
+
+
+def estimate_encrypted_size(cleartext: dict) -> int:
+    """ Approximate size of the encrypted_data of an item (base64 ciphertext and headers). """
+    return estimate_serialized_size(cleartext) * 4 // 3 + 200
+
+
+class PipelinedBatchSender:
+    """
+    Sends batches in the background while the next ones are being prepared, up to the shared in-flight window.
+    The truncate batch is sent alone and must be acknowledged before any other batch goes out.
+    Retries are flagged: the batch may have been inserted before the error (e.g. timeout on the response).
+    Transient errors are retried with an exponential backoff and jitter, rejected batches are not retried.
+    """
+
+    def __init__(self, send: Callable[[list[dict], bool, Optional[int], bool], Awaitable[None]], window: AimdWindow, retries=2):
+        self.__logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.__send_method = send
+        self.__window = window
+        self.__retries = retries
+        self.__pending: set[asyncio.Task] = set()
+        self.__error: Optional[BaseException] = None
+
+    async def submit(self, batch: list[dict], truncate: bool, batch_size: Optional[int] = None):
+        self.__raise_error()
+        if truncate:
+            await self.wait()
+            await self.__window.acquire()
+            try:
+                await self.__send(batch, truncate, batch_size)
+            finally:
+                await self.__window.release()
+            return
+
+        await self.__window.acquire()
+        task = asyncio.create_task(self.__send_release(batch, batch_size))
+        self.__pending.add(task)
+        task.add_done_callback(self.__on_done)
+
+    async def wait(self):
+        """ Waits for all batches in flight, raises the first error. """
+        if len(self.__pending) > 0:
+            await asyncio.gather(*self.__pending, return_exceptions=True)
+        self.__raise_error()
+
+    def cancel(self):
+        for task in self.__pending:
+            task.cancel()
+
+    async def __send_release(self, batch: list[dict], batch_size: Optional[int]):
+        try:
+            await self.__send(batch, False, batch_size)
+        finally:
+            await self.__window.release()
+
+    async def __send(self, batch: list[dict], truncate: bool, batch_size: Optional[int]):
+        attempt = 0
+        while True:
+            start = time.monotonic()
+            try:
+                await self.__send_method(batch, truncate, batch_size, attempt > 0)
+            except BatchRejectedException as e:
+                self.__window.on_failure()
+                raise e
+            except Exception as e:
+                self.__window.on_failure()
+                attempt += 1
+                if attempt > self.__retries:
+                    raise e
+                delay = min(CONST_RETRY_DELAY_MAX, CONST_RETRY_DELAY * 2 ** (attempt - 1))
+                delay = random.uniform(delay / 2, delay)  # Spread the retries of the batches that failed together
+                self.__logger.warning("Error sending batch, retrying in %.1f seconds (attempt %d): %s", delay, attempt, e)
+                await asyncio.sleep(delay)
+            else:
+                self.__window.on_success(time.monotonic() - start)
+                return
+
+    def __on_done(self, task: asyncio.Task):
+        self.__pending.discard(task)
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error is not None and self.__error is None:
+            self.__error = error
+
+    def __raise_error(self):
+        if self.__error is not None:
+            raise self.__error
+
+
 class FeedViewDataProcessor:
 
     def __init__(self, context: DatasourceMapperContext, job: ProcessJob):
         self.__logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
         self._context = context
         self._job = job
+        self._published_index: Optional[PublishedIdIndex] = None
+
+    async def load_published_index(self):
+        """ Loads the ids already published to the view. The index starts over when the view gets truncated. """
+        if self._context.configuration.published_index is False:
+            return
+        feed_view_id = self._job.view['feed_view_id']
+        index = PublishedIdIndex(pathlib.Path(self._context.configuration.dir_data, 'published', f'{feed_view_id}.idx'))
+        if self._job.reset:
+            await asyncio.to_thread(index.clear)
+        else:
+            await asyncio.to_thread(index.load)
+        self._published_index = index
 
     async def read_data_items(self):
-        with gzip.open(self._job.data_file_path, 'rt') as fp:
-            while True:
-                line = await asyncio.to_thread(fp.readline, 1024 * 1024 * 16)  # Max 16 mb per record
-                if len(line) == 0:
-                    return
-                yield FeedDataItem.from_str(line)
+        async for record in iter_view_records(self._job.staging_paths or list(), self._job.staging_after):
+            yield FeedDataItem.from_dict(record)
+
+    async def parse_feed_items(self) -> AsyncIterable[tuple[FeedDataItem, AsyncIterable[DatedItemData]]]:
+        """ :return: Each staged data item with the items parsed from it """
+        async for data_item in self.read_data_items():
+            cache_key = self.parse_cache_key(data_item)
+            cached_items = await self.load_cached_items(cache_key)
+            if cached_items is not None:
+                yield data_item, cached_items
+            else:
+                yield data_item, self.cache_parsed_items(cache_key, self.parse_data_items(data_item.data))
+
+    def mapping_hash(self) -> Optional[str]:
+        """ :return: Hash of the mapping used to parse the data items, None when parse results are not cached """
+        return None
+
+    def parse_cache_key(self, data_item: FeedDataItem) -> Optional[str]:
+        """ :return: Parse result cache key of a data item, None when the cache is not used """
+        if self._context.parse_cache.enabled is False:
+            return None
+        mapping_hash = self.mapping_hash()
+        if mapping_hash is None:
+            return None
+        return self._context.parse_cache.make_key(mapping_hash, data_item.data)
+
+    async def load_cached_items(self, cache_key: Optional[str]) -> Optional[AsyncIterable[DatedItemData]]:
+        """ :return: Items parsed from the same data with the same mapping, None on a cache miss """
+        if cache_key is None:
+            return None
+        parse_cache = self._context.parse_cache
+        path = parse_cache.get(cache_key)
+        if path is None:
+            return None
+        items = await asyncio.to_thread(parse_cache.read_items, path)
+        if items is None:
+            parse_cache.remove(cache_key)
+            return None
+        return self.__iter_cached_items(items)
+
+    async def __iter_cached_items(self, items: list[dict]):
+        for item in items:
+            yield item_from_dict(item)
+
+    async def cache_parsed_items(self, cache_key: Optional[str], parsed_items: AsyncIterable[DatedItemData]):
+        """ Passes the parsed items through and caches them once all were parsed without error. """
+        if cache_key is None:
+            async for item in parsed_items:
+                yield item
+            return
+
+        serialized = list()
+        async for item in parsed_items:
+            serialized.append(item.to_dict())
+            yield item
+
+        parse_cache = self._context.parse_cache
+        try:
+            temp_path = await asyncio.to_thread(parse_cache.write_temporary, serialized)
+            parse_cache.commit(cache_key, temp_path)
+        except OSError:
+            self.__logger.exception("Error caching parse results")
 
     async def process(self):
         self.__logger.debug("Processing data")
         count_item = 0
         count_sub_item = 0
+        count_published = 0
+
+        await self.load_published_index()
+        published_index = self._published_index
 
         # Truncate on first batch only
         truncate = self._job.reset
 
+        # Batches are bounded by item count and size, and flushed after a delay.
+        # Items are prepared in cleartext and the whole batch gets encrypted off the event loop on flush.
+        batch_sizer = self._context.batch_sizer
         batch: list[dict] = list()
-        async for data_item in self.read_data_items():
-            count_item += 1
-            try:
-                async for parsed_item in self.parse_data_items(data_item.data):
+        batch_cleartext: list[dict] = list()
+        batch_size = 0
+        batch_start = time.monotonic()
+
+        # Parsing runs in its own task, a partial batch is flushed on time while waiting for the next parse result.
+        # Parsing and encryption continue while batches are in flight.
+        parsed_queue: asyncio.Queue = asyncio.Queue(CONST_PARSED_QUEUE_SIZE)
+        producer = asyncio.create_task(self.__produce_parsed_items(parsed_queue))
+        sender = PipelinedBatchSender(self.send_batch, self._context.send_window)
+
+        async def flush():
+            nonlocal batch, batch_cleartext, batch_size, truncate
+            await self.encrypt_batch(batch, batch_cleartext)
+            await sender.submit(batch, truncate, batch_size)
+            truncate = False  # Reset truncation to keep batches
+            batch = list()
+            batch_cleartext = list()
+            batch_size = 0
+
+        try:
+            while True:
+                timeout = None
+                if len(batch) > 0:
+                    timeout = max(0.0, batch_start + batch_sizer.flush_seconds - time.monotonic())
+                try:
+                    async with asyncio.timeout(timeout):
+                        value = await parsed_queue.get()
+                except TimeoutError:
+                    value = False  # Flush delay expired
+                if value is None:
+                    break  # Done
+                elif isinstance(value, Exception):
+                    raise value
+
+                if value is False:
+                    await flush()
+                    continue
+
+                data_item, parsed_item = value
+                # Mappers yield single items or a columnar DatedItemBatch
+                rows = parsed_item if isinstance(parsed_item, DatedItemBatch) else (parsed_item,)
+                for item in rows:
                     count_sub_item += 1
-                    prepared_item = await self.produce_data_item(data_item, parsed_item)
+                    if published_index is not None and published_index.contains(item.data_id):
+                        count_published += 1
+                        continue  # Already published, skip encryption and transfer
+                    prepared_item = self.prepare_data_item(data_item, item)
+                    cleartext = item.get_cleartext()
+                    if len(batch) == 0:
+                        batch_start = time.monotonic()
                     batch.append(prepared_item)
-                    if len(batch) >= 20:
-                        await self.send_batch(batch, truncate)
-                        truncate = False  # Reset truncation to keep batches
-                        batch.clear()
-            except FeedParsingException:
-                pass  # Already logged
-
-        if len(batch) > 0:
-            await self.send_batch(batch, truncate)
-
-        self.__logger.info(f"Parsed through {count_item} data items and {count_sub_item} sub-items for feed_view {self._job.view['feed_view_id']}")
-
-    async def produce_data_item(self, feed_item: FeedDataItem, item: DatedItemData):
+                    batch_cleartext.append(cleartext)
+                    batch_size += estimate_serialized_size(prepared_item) + estimate_encrypted_size(cleartext)
+                    if batch_sizer.is_full(len(batch), batch_size) or time.monotonic() - batch_start >= batch_sizer.flush_seconds:
+                        await flush()
+                        if self._job.yield_point is not None:
+                            await self._job.yield_point()  # Lets more urgent jobs through
+
+            count_item = await producer
+            if len(batch) > 0:
+                await flush()
+            await sender.wait()
+        except BaseException as e:
+            producer.cancel()
+            await asyncio.gather(producer, return_exceptions=True)
+            sender.cancel()
+            raise e
+        finally:
+            if published_index is not None:
+                # Keep the ids acknowledged so far, even when the job fails
+                await asyncio.to_thread(published_index.save)
+
+        self.__logger.info(f"Parsed through {count_item} data items and {count_sub_item} sub-items for feed_view {self._job.view['feed_view_id']} ({count_published} already published)")
+
+    async def __produce_parsed_items(self, parsed_queue: asyncio.Queue) -> int:
+        """
+        Puts each parsed item with its data item in the queue, then None. An error is put in the queue instead of None.
+        :return: Number of data items
+        """
+        count_item = 0
+        try:
+            async for data_item, parsed_items in self.parse_feed_items():
+                count_item += 1
+                try:
+                    async for parsed_item in parsed_items:
+                        await parsed_queue.put((data_item, parsed_item))
+                except FeedParsingException:
+                    pass  # Already logged
+        except Exception as e:
+            await parsed_queue.put(e)
+            return count_item
+        await parsed_queue.put(None)
+        return count_item
+
+    async def encrypt_batch(self, batch: list[dict], cleartext: list[dict]):
+        """
+        Serializes and encrypts the cleartext of a batch in one call, outside the event loop.
+        Sets encrypted_data on each prepared item of the batch.
+        """
+        job = self._job
+        executor = self._context.encryption_executor
+        loop = asyncio.get_running_loop()
+        encrypted = await loop.run_in_executor(executor, encrypt_cleartext, job.encryption_key, cleartext)
+        for (data_item, encrypted_data) in zip(batch, encrypted):
+            encrypted_data['cle_id'] = job.encryption_key_id
+            data_item['encrypted_data'] = encrypted_data
+
+    def prepare_data_item(self, feed_item: FeedDataItem, item: Union[DatedItemBase, DatedItemRow]) -> dict:
+        """ Prepares an item for insertViewData, without the encrypted_data. """
         job = self._job
-        cleartext = item.get_cleartext()
-        encrypted_data = chiffrer_mgs4_bytes_secrete(job.encryption_key, json.dumps(cleartext))[1]
-        encrypted_data['cle_id'] = job.encryption_key_id
-
         data_item = {
             'data_id': item.data_id,
             'feed_id': job.feed['feed_id'],
             'feed_view_id': job.view['feed_view_id'],
-            'encrypted_data': encrypted_data,
             'pub_date': item.date * 1000,   # Pub date in millisecs
         }
 
-        if isinstance(item, GroupedDatedItemData):
-            data_item['group_id'] = hash_to_id(item.group)
+        group_id = item.group_id
+        if group_id is not None:
+            data_item['group_id'] = group_id
 
         # Check if we need to link a picture
         try:
@@ -109,7 +385,8 @@ class FeedViewDataProcessor:
 
         return data_item
 
-    async def send_batch(self, batch: list[DatedItemData], truncate: False):
+    async def send_batch(self, batch: list[dict], truncate: False, batch_size: Optional[int] = None, retry=False):
+        """ :param retry: The batch was sent before and may already be inserted, DataCollector deduplicates it """
         # Detect the type of data
         item = batch[0]
         action = 'insertViewData'
@@ -126,11 +403,18 @@ class FeedViewDataProcessor:
             'feed_id': self._job.feed['feed_id'],
             'data': batch,
             'truncate': truncate,
-            'deduplicate': False,
+            'deduplicate': retry,
         }
+        start = time.monotonic()
         response = await producer.command(command, 'DataCollector', action, Constantes.SECURITE_PROTEGE)
         if response.parsed['ok'] is not True:
-            raise Exception(f'Error saving batch: {response.parsed.get('err')}')
+            raise BatchRejectedException(f'Error saving batch: {response.parsed.get('err')}')
+        if self._published_index is not None:
+            self._published_index.add(item['data_id'] for item in batch)
+
+        if batch_size is None:
+            batch_size = estimate_serialized_size(batch)
+        self._context.batch_sizer.update(time.monotonic() - start, len(batch), batch_size)
 
     async def parse_data_items(self, feed_data_item: str) -> AsyncIterable[DatedItemData]:
         raise NotImplementedError('must implement')
@@ -156,34 +440,136 @@ class FeedViewDataProcessorPythonCustom(FeedViewDataProcessor):
     def __init__(self, context: DatasourceMapperContext, job: ProcessJob):
         super().__init__(context, job)
         self.__logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
-        self.__processing_method: Optional = None
+        self.__mapper: Optional[CompiledMapper] = None
+        self.__mapping_hash: Optional[str] = None
 
-    async def parse_data_items(self, feed_data_item: str):
-        custom_process: str = self._job.view['mapping_code']
+    def mapping_hash(self) -> Optional[str]:
+        if self.__mapping_hash is None:
+            self.__mapping_hash = hash_mapping_code(self._job.view['mapping_code'])
+        return self.__mapping_hash
 
+    async def process(self):
+        await super().process()
+        feed_view_id = self._job.view['feed_view_id']
+        stats = self._context.mapper_cache.view_stats(feed_view_id)
+        if stats is not None:
+            self.__logger.debug("Mapper for feed_view %s: %d hits / %d misses, compile %.3fs, exec %.3fs",
+                                feed_view_id, stats['hits'], stats['misses'], stats['compile_time'], stats['exec_time'])
+
+    def get_mapper(self) -> CompiledMapper:
+        """ Mapper compiled and executed once, reused for all items of the job and across jobs. """
+        if self.__mapper is None:
+            custom_process: str = self._job.view['mapping_code']
+            try:
+                self.__mapper, _cached = self._context.mapper_cache.get(custom_process, self._job.view['feed_view_id'])
+            except Exception as e:
+                self.__logger.exception("Error parsing custom process")
+                raise e
+        return self.__mapper
+
+    async def parse_feed_items(self) -> AsyncIterable[tuple[FeedDataItem, AsyncIterable[DatedItemData]]]:
+        pool = self._context.mapper_pool
+        if pool is None:
+            async for value in super().parse_feed_items():
+                yield value
+            return
+
+        # Batches of data items are parsed in the worker processes, keeping one batch per worker in flight.
+        # Cached results are yielded right away, ahead of the pending batches.
+        mapping_code: str = self._job.view['mapping_code']
+        feed_view_id: str = self._job.view['feed_view_id']
+        pending: collections.deque[tuple[list[tuple[FeedDataItem, Optional[str]]], asyncio.Future]] = collections.deque()
         try:
-            self.__processing_method = compile(custom_process, '<string>', 'exec')
+            batch: list[tuple[FeedDataItem, Optional[str]]] = list()
+            async for data_item in self.read_data_items():
+                cache_key = self.parse_cache_key(data_item)
+                cached_items = await self.load_cached_items(cache_key)
+                if cached_items is not None:
+                    yield data_item, cached_items
+                    continue
+                batch.append((data_item, cache_key))
+                if len(batch) >= pool.batch_items:
+                    pending.append((batch, asyncio.ensure_future(pool.parse(mapping_code, [d.data for (d, _k) in batch], feed_view_id))))
+                    batch = list()
+                    while len(pending) > pool.processes:
+                        async for value in self.__pop_results(pending):
+                            yield value
+            if len(batch) > 0:
+                pending.append((batch, asyncio.ensure_future(pool.parse(mapping_code, [d.data for (d, _k) in batch], feed_view_id))))
+            while len(pending) > 0:
+                async for value in self.__pop_results(pending):
+                    yield value
+        finally:
+            for (_batch, future) in pending:
+                future.cancel()
+
+    async def __pop_results(self, pending: collections.deque):
+        batch, future = pending.popleft()
+        results = await future
+        for ((data_item, cache_key), result) in zip(batch, results):
+            yield data_item, self.cache_parsed_items(cache_key, self.__iter_result(result))
+
+    async def __iter_result(self, result: dict):
+        try:
+            items = result['items']
         except KeyError:
-            self.__processing_method = None
-        except Exception as e:
-            self.__logger.exception("Error parsing custom process")
-            self.__processing_method = None
-            raise e
+            self.__logger.error("Error parsing dataset for feed_id:%s: %s", self._job.view.get('feed_id'), result.get('error'))
+            raise FeedParsingException(result.get('error'))
+        for item in items:
+            yield item_from_dict(item)
 
-        values = {}  # Local context
-        exec(self.__processing_method, values)
+    async def parse_data_items(self, feed_data_item: str):
+        mapper = self.get_mapper()
         try:
-            async for item in values['parse'](feed_data_item):
+            async for item in mapper.parse(feed_data_item):
                 yield item
         except Exception as e:
             self.__logger.exception("Error parsing dataset for feed_id:%s", self._job.view.get('feed_id'))
             raise FeedParsingException(str(e))
 
 
+class FeedViewDataProcessorDeclarative(FeedViewDataProcessor):
+    """ Maps items with the declarative mapping of the view (mapping_declarative), no code is executed. """
+
+    def __init__(self, context: DatasourceMapperContext, job: ProcessJob):
+        super().__init__(context, job)
+        self.__logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.__mapping: Optional[CompiledMapping] = None
+        self.__mapping_hash: Optional[str] = None
+
+    def mapping_hash(self) -> Optional[str]:
+        if self.__mapping_hash is None:
+            self.__mapping_hash = hash_mapping(self._job.view['mapping_declarative'])
+        return self.__mapping_hash
+
+    def get_mapping(self) -> CompiledMapping:
+        if self.__mapping is None:
+            try:
+                self.__mapping = compile_mapping(self._job.view['mapping_declarative'])
+            except Exception as e:
+                self.__logger.exception("Error compiling declarative mapping")
+                raise e
+        return self.__mapping
+
+    async def parse_data_items(self, feed_data_item: str) -> AsyncIterable[DatedItemBatch]:
+        mapping = self.get_mapping()
+        try:
+            batch = await asyncio.to_thread(mapping.parse, feed_data_item)
+        except Exception as e:
+            self.__logger.exception("Error parsing dataset for feed_id:%s", self._job.view.get('feed_id'))
+            raise FeedParsingException(str(e))
+        yield batch
+
+
 def select_data_processor(context: DatasourceMapperContext, job: ProcessJob) -> FeedViewDataProcessor:
     feed_type = job.feed['feed_type']
 
-    if feed_type == 'web.scraper.python_custom':
+    if job.view.get('mapping_declarative') and feed_type in ('web.scraper.python_custom', 'web.scraper.declarative'):
+        # A declarative mapping takes precedence over the mapping code
+        return FeedViewDataProcessorDeclarative(context, job)
+    elif feed_type == 'web.scraper.declarative':
+        return FeedViewDataProcessorWIP(context, job)
+    elif feed_type == 'web.scraper.python_custom':
         mapping_code = job.view.get('mapping_code')
         if mapping_code is not None and mapping_code != '':
             return FeedViewDataProcessorPythonCustom(context, job)
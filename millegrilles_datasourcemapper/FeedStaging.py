@@ -0,0 +1,231 @@
+import json
+import logging
+import os
+import pathlib
+
+from typing import AsyncIterator, Iterable, Optional
+
+from millegrilles_datasourcemapper.StagingFile import StagingChunk, delete_staging, get_index_path, iter_staging_records
+
+# Data items of a feed are downloaded once and staged in segments shared by all the views of the feed.
+# Each segment lists the views that still have to process it (audience). Each view keeps its own cursor
+# (save_date, data_id) of the data it processed. A segment is deleted once its whole audience processed it.
+
+STATE_VERSION = 1
+
+
+def cursor_key(value: dict) -> (int, str):
+    """ Sort key of a data item or cursor, matches the (save_date, data_id) order of getFeedData. """
+    return value['save_date'], value['data_id']
+
+
+def _position(most_recent_date: Optional[int], cursor: Optional[dict]) -> (int, str):
+    if cursor is not None:
+        return cursor_key(cursor)
+    return most_recent_date or 0, ''
+
+
+def _max_cursor(current: Optional[dict], value: Optional[dict]) -> Optional[dict]:
+    if value is None:
+        return current
+    if current is None or cursor_key(value) > cursor_key(current):
+        return value
+    return current
+
+
+class FeedStaging:
+    """
+    Staging state of a feed. Not thread safe, mutated from the event loop.
+    Blocking file operations are small (json state, unlink).
+    """
+
+    def __init__(self, path: pathlib.Path):
+        self.__logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.__path = path
+        self.__state_path = path / 'staging.json'
+        self.__state = {'version': STATE_VERSION, 'most_recent_date': None, 'cursor': None,
+                        'views': dict(), 'segments': list(), 'next_segment': 0}
+        self.__open_segments: set[str] = set()
+
+    @property
+    def path(self) -> pathlib.Path:
+        return self.__path
+
+    def load(self):
+        self.__path.mkdir(parents=True, exist_ok=True)
+        try:
+            with open(self.__state_path) as fp:
+                state = json.load(fp)
+        except FileNotFoundError:
+            return
+        except json.JSONDecodeError:
+            self.__logger.warning("Corrupted feed staging state %s, starting over", self.__state_path)
+            return
+        if state.get('version') != STATE_VERSION:
+            raise ValueError('Unsupported feed staging version %s' % state.get('version'))
+        self.__state = state
+
+    def save(self):
+        temp_path = pathlib.Path(f'{self.__state_path}.tmp')
+        with open(temp_path, 'wt') as fp:
+            json.dump(self.__state, fp)
+        os.replace(temp_path, self.__state_path)
+
+    def is_known(self, feed_view_id: str) -> bool:
+        return feed_view_id in self.__state['views']
+
+    def view_cursor(self, feed_view_id: str) -> Optional[dict]:
+        """
+        :return: Cursor of the data the view processed, None when the view starts over.
+                 Views imported with only a most_recent_date get a cursor on that date.
+        """
+        try:
+            view = self.__state['views'][feed_view_id]
+        except KeyError:
+            return None
+        if view['cursor'] is None and view['most_recent_date'] is not None:
+            return {'save_date': view['most_recent_date'], 'data_id': ''}
+        return view['cursor']
+
+    def add_view(self, feed_view_id: str, cursor: Optional[dict] = None, most_recent_date: Optional[int] = None):
+        self.__state['views'][feed_view_id] = {'cursor': cursor, 'most_recent_date': most_recent_date}
+
+    def reset_view(self, feed_view_id: str):
+        """ The view starts over, it processes the data of the next download from the start. """
+        self.__remove_from_audiences(feed_view_id, [s['name'] for s in self.__state['segments']])
+        self.add_view(feed_view_id)
+
+    def prune_views(self, active_view_ids: Iterable[str]):
+        """ Forgets views that are no longer active, they do not hold segments anymore. """
+        active_view_ids = set(active_view_ids)
+        for feed_view_id in [v for v in self.__state['views'].keys() if v not in active_view_ids]:
+            self.__logger.info("Removing inactive feed view %s from the staging of %s", feed_view_id, self.__path)
+            self.__remove_from_audiences(feed_view_id, [s['name'] for s in self.__state['segments']])
+            del self.__state['views'][feed_view_id]
+
+    def download_start(self, feed_view_ids: Iterable[str]) -> (Optional[int], Optional[dict]):
+        """
+        :return: most_recent_date (epoch ms) and cursor to download from, None for the whole feed.
+                 Starts from the feed cursor unless a view is behind it (new or reset view).
+        """
+        most_recent_date, cursor = self.__state['most_recent_date'], self.__state['cursor']
+        if cursor is None and most_recent_date is None:
+            return None, None
+        for feed_view_id in feed_view_ids:
+            view = self.__state['views'][feed_view_id]
+            if view['cursor'] is None and view['most_recent_date'] is None:
+                return None, None  # Start over for this view
+            view_most_recent_date, view_cursor = self.__received(feed_view_id)
+            if _position(view_most_recent_date, view_cursor) < _position(most_recent_date, cursor):
+                most_recent_date, cursor = view_most_recent_date, view_cursor
+        return most_recent_date, cursor
+
+    def open_segment(self, most_recent_date: Optional[int] = None, cursor: Optional[dict] = None) -> (pathlib.Path, dict):
+        """
+        :param most_recent_date: Start of the download, from download_start
+        :param cursor: Start cursor of the download, from download_start
+        :return: Path of a new segment and its state. The audience is the views of the feed that received
+                 the data up to the start of the download, views behind it need their own download.
+        """
+        start = _position(most_recent_date, cursor)
+        name = 'segment_%d.staging' % self.__state['next_segment']
+        self.__state['next_segment'] += 1
+        audience = [v for v in self.__state['views'].keys() if _position(*self.__received(v)) >= start]
+        segment = {'name': name, 'audience': audience, 'cursor': None, 'most_recent_date': None}
+        self.__state['segments'].append(segment)
+        self.__open_segments.add(name)
+        return self.__path / name, segment
+
+    def checkpoint(self, segment: dict, most_recent_date: int, cursor: Optional[dict]):
+        """ Records the progress of a download, the data up to the cursor is in the segment. """
+        segment['most_recent_date'] = max(segment['most_recent_date'] or 0, most_recent_date)
+        segment['cursor'] = _max_cursor(segment['cursor'], cursor)
+        self.__state['most_recent_date'] = max(self.__state['most_recent_date'] or 0, most_recent_date)
+        self.__state['cursor'] = _max_cursor(self.__state['cursor'], cursor)
+        self.save()
+
+    def close_segment(self, segment: dict):
+        self.__open_segments.discard(segment['name'])
+        if segment['most_recent_date'] is None:
+            # No data written
+            self.__state['segments'].remove(segment)
+            delete_staging(self.__path / segment['name'])
+        self.save()
+
+    def add_segment(self, feed_view_id: str, source: pathlib.Path):
+        """ Moves an existing staging file in the feed staging, for a single view. """
+        path, segment = self.open_segment()
+        os.replace(source, path)
+        try:
+            os.replace(get_index_path(source), get_index_path(path))
+        except FileNotFoundError:
+            pass
+        segment['audience'] = [feed_view_id]
+        segment['most_recent_date'] = self.__state['views'][feed_view_id]['most_recent_date'] or 0
+        segment['cursor'] = self.__state['views'][feed_view_id]['cursor']
+        self.__open_segments.discard(segment['name'])
+
+    def view_segments(self, feed_view_id: str) -> list[str]:
+        """ :return: Names of the completed segments the view has to process, in order """
+        return [s['name'] for s in self.__state['segments']
+                if feed_view_id in s['audience'] and s['name'] not in self.__open_segments]
+
+    def consumed(self, feed_view_id: str, segment_names: list[str]):
+        """ The view processed the segments. Moves its cursor and deletes the segments processed by all views. """
+        view = self.__state['views'].get(feed_view_id)
+        if view is None:
+            return
+        for segment in self.__state['segments']:
+            # Segments the view left since it started reading them (reset) do not move its cursor
+            if segment['name'] in segment_names and feed_view_id in segment['audience']:
+                view['cursor'] = _max_cursor(view['cursor'], segment['cursor'])
+                view['most_recent_date'] = max(view['most_recent_date'] or 0, segment['most_recent_date'] or 0)
+        self.__remove_from_audiences(feed_view_id, segment_names)
+        self.save()
+
+    def __received(self, feed_view_id: str) -> (Optional[int], Optional[dict]):
+        """ :return: Position of the data received by the view, the segments waiting for the view count as received. """
+        view = self.__state['views'][feed_view_id]
+        most_recent_date, cursor = view['most_recent_date'], view['cursor']
+        for segment in self.__state['segments']:
+            if feed_view_id in segment['audience']:
+                most_recent_date = max(most_recent_date or 0, segment['most_recent_date'] or 0)
+                cursor = _max_cursor(cursor, segment['cursor'])
+        return most_recent_date, cursor
+
+    def __remove_from_audiences(self, feed_view_id: str, segment_names: list[str]):
+        for segment in list(self.__state['segments']):
+            if segment['name'] not in segment_names:
+                continue
+            try:
+                segment['audience'].remove(feed_view_id)
+            except ValueError:
+                pass
+            if len(segment['audience']) == 0 and segment['name'] not in self.__open_segments:
+                self.__state['segments'].remove(segment)
+                delete_staging(self.__path / segment['name'])
+
+
+async def iter_view_records(paths: list[pathlib.Path], after: Optional[dict]) -> AsyncIterator[dict]:
+    """
+    Reads the records of segments, skipping the ones a view already processed and the ones repeated
+    by overlapping segments (download resumed from an older position).
+    :param paths: Segment files
+    :param after: Cursor of the view, None to read all the records
+    """
+    chunk_filter = None
+    if after is not None:
+        def chunk_filter(chunk: StagingChunk) -> bool:
+            return chunk['save_date_max'] is None or chunk['save_date_max'] >= after['save_date']
+
+    position = cursor_key(after) if after is not None else None
+    for path in paths:
+        if path.exists() is False:
+            continue  # Removed by a reset of the view
+        async for record in iter_staging_records(path, chunk_filter=chunk_filter):
+            if 'save_date' in record:
+                record_position = cursor_key(record)
+                if position is not None and record_position <= position:
+                    continue  # Already processed by the view
+                position = record_position
+            yield record
@@ -1,176 +1,385 @@
 import asyncio
 import datetime
+import functools
 import logging
 import json
-import gzip
 import math
 import os
 import pathlib
-import tempfile
+import time
 import zlib
 
-from typing import Optional, Union
+from typing import Callable, Optional, Union
 
 from aiohttp import ClientResponseError
 
-from millegrilles_datasourcemapper.DataStructures import ProcessJob
+from millegrilles_datasourcemapper.AdaptiveSizing import AdaptivePageSize
+from millegrilles_datasourcemapper.DataStructures import ProcessJob, PRIORITY_INTERACTIVE, PRIORITY_UPDATE
 from millegrilles_datasourcemapper.FeedDataProcessor import select_data_processor
-from millegrilles_datasourcemapper.Util import decode_base64_nopad
-from millegrilles_messages.chiffrage.DechiffrageUtils import dechiffrer_reponse, dechiffrer_bytes_secrete
+from millegrilles_datasourcemapper.FeedStaging import FeedStaging, cursor_key
+from millegrilles_datasourcemapper.JobScheduler import CoalescingScheduler, FairJobQueue, SingleFlightGroup
+from millegrilles_datasourcemapper.StagingFile import StagingWriter, convert_jsonl_gz, delete_staging, get_codec
+from millegrilles_datasourcemapper.Util import encode_base64_nopad
+from millegrilles_messages.chiffrage.DechiffrageUtils import dechiffrer_bytes_secrete
 from millegrilles_messages.messages import Constantes
 from millegrilles_datasourcemapper.Context import DatasourceMapperContext
 from millegrilles_messages.messages.MessagesModule import MessageWrapper
 
 
 class FeedViewProcessor:
+    """
+    Runs the jobs of the process queue on a pool of workers. The pool starts with the minimum number of
+    workers and grows up to the maximum while jobs are waiting with no idle worker to take them, unless the
+    stages shared by the jobs are saturated: jobs already wait for the feed download, or the mapper worker
+    processes are all busy. Another worker would only add a waiter. Extra workers shut down after staying idle,
+    between jobs. Workers of jobs yielding to more urgent ones do not count toward the maximum.
+    """
 
     def __init__(self, context: DatasourceMapperContext):
         self.__logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
         self.__context = context
-        self.__process_queue: asyncio.Queue[Optional[ProcessJob]] = asyncio.Queue(maxsize=1)
+        configuration = context.configuration
+        self.__process_queue = FairJobQueue(max(1, configuration.process_queue_size), configuration.process_time_slice,
+                                            on_yield=self.__scale_up)
         self.__workers: list[FeedViewProcessorWorker] = list()
+        self.__workers_min = max(1, configuration.process_workers_min)
+        self.__workers_max = max(self.__workers_min, configuration.process_workers_max or os.cpu_count() or 1)
+        self.__worker_count = 0  # Used for worker ids
+        self.__group: Optional[asyncio.TaskGroup] = None
+        self.__scheduler = CoalescingScheduler(self.__process_queue, configuration.process_debounce, self.__scale_up)
+        self.__flights = SingleFlightGroup()
 
         self.__staging_feeds_path = pathlib.Path(f'{self.__context.configuration.dir_data}/feeds')
-        self.__feed_data_downloader = FeedDataDownloader(context, self.__staging_feeds_path)
+        self.__feed_data_downloader = FeedDataDownloader(context, self.__staging_feeds_path, on_available=self.__scale_up)
+
+    @property
+    def stats(self) -> dict:
+        busy = len([w for w in self.__workers if w.busy])
+        stats = {'workers': len(self.__workers), 'busy': busy, 'queued': self.__process_queue.qsize()}
+        stats.update(self.__feed_data_downloader.stats)
+        if self.__context.mapper_pool is not None:
+            stats['mapper_utilization'] = self.__context.mapper_pool.utilization
+        stats.update(self.__scheduler.stats)
+        stats.update(self.__process_queue.stats)
+        stats.update(self.__flights.stats)
+        return stats
 
     async def run(self):
         async with asyncio.TaskGroup() as group:
+            self.__group = group
             group.create_task(self.__stop_thread())
             # Create all worker threads
             for w in self.__workers:
-                group.create_task(w.run())
+                group.create_task(self.__run_worker(w))
 
     async def __stop_thread(self):
         await self.__context.wait()
-        for w in self.__workers:
+        self.__scheduler.cancel()
+        for w in list(self.__workers):
             await w.cancel()
-            # Unblock waiters
+        # Unblock waiters, there can be more workers than room in the queue
+        while len(self.__workers) > 0:
             try:
                 self.__process_queue.put_nowait(None)
             except asyncio.QueueFull:
                 pass
+            await asyncio.sleep(0.1)
+        if self.__context.encryption_executor is not None:
+            self.__context.encryption_executor.shutdown(wait=False, cancel_futures=True)
+        if self.__context.mapper_pool is not None:
+            self.__context.mapper_pool.shutdown()
 
     async def setup(self):
         self.__staging_feeds_path.mkdir(parents=True, exist_ok=True)
-        num_workers = 2
-        for i in range(0, num_workers):
-            self.__workers.append(FeedViewProcessorWorker(self.__context, self.__feed_data_downloader, self.__process_queue, worker_id=str(i)))
+        await asyncio.to_thread(self.__context.blob_cache.load)
+        await asyncio.to_thread(self.__context.parse_cache.load)
+        for i in range(0, self.__workers_min):
+            self.__add_worker()
 
     async def add_to_queue(self, message: MessageWrapper, reset_staging=False):
         job = ProcessJob(message)
         if reset_staging:
+            # processFeedView command
             job.reset = True
-        self.__process_queue.put_nowait(job)
+            job.priority = PRIORITY_INTERACTIVE
+        else:
+            job.priority = PRIORITY_UPDATE
+        self.__scheduler.submit(job)
 
     async def add_updates_to_queue(self, message: MessageWrapper):
-        job = ProcessJob(message)
+        # Merged with the pending or running job of the same views, never dropped
+        self.__scheduler.submit(ProcessJob(message))
+
+    def __add_worker(self) -> 'FeedViewProcessorWorker':
+        worker = FeedViewProcessorWorker(self.__context, self.__feed_data_downloader, self.__process_queue,
+                                         worker_id=str(self.__worker_count),
+                                         idle_timeout=self.__context.configuration.process_worker_idle_timeout,
+                                         may_retire=self.__may_retire, scheduler=self.__scheduler, flights=self.__flights)
+        self.__worker_count += 1
+        self.__workers.append(worker)
+        return worker
+
+    def __scale_up(self):
+        """ Adds workers while jobs are waiting and no worker is idle. """
+        if self.__group is None or self.__context.stopping:
+            return  # Not running yet, the initial workers start with run()
+        if self.__stages_saturated():
+            return  # Called again when a download completes
+        idle = len([w for w in self.__workers if w.busy is False])
+        active = len([w for w in self.__workers if w.yielded is False])
+        while self.__process_queue.qsize() > idle and active < self.__workers_max:
+            worker = self.__add_worker()
+            self.__group.create_task(self.__run_worker(worker))
+            idle += 1
+            active += 1
+            self.__logger.debug("Added worker %s (%s)", worker.worker_id, self.stats)
+
+    def __stages_saturated(self) -> bool:
+        if self.__feed_data_downloader.waiting > 0:
+            return True
+        mapper_pool = self.__context.mapper_pool
+        return mapper_pool is not None and mapper_pool.utilization >= 1.0
+
+    def __may_retire(self, worker: 'FeedViewProcessorWorker') -> bool:
+        """ Called by an idle worker, keeps the minimum number of workers. """
+        if len(self.__workers) <= self.__workers_min or self.__process_queue.qsize() > 0:
+            return False
+        self.__workers.remove(worker)
+        self.__logger.debug("Retired idle worker %s (%s)", worker.worker_id, self.stats)
+        return True
+
+    async def __run_worker(self, worker: 'FeedViewProcessorWorker'):
         try:
-            self.__process_queue.put_nowait(job)
-        except asyncio.QueueFull:
-            # Queue full, ignore this trigger event
-            return
-
+            await worker.run()
+        finally:
+            try:
+                self.__workers.remove(worker)
+            except ValueError:
+                pass  # Retired
 
 
 class FeedDataDownloader:
     """
-    Downloads and decrypts feed data into a staging area.
+    Downloads and decrypts feed data into a staging area. The data of a feed is downloaded once for all its views.
     """
 
-    def __init__(self, context: DatasourceMapperContext, staging_path: pathlib.Path, threads=1):
+    def __init__(self, context: DatasourceMapperContext, staging_path: pathlib.Path, threads=1,
+                 on_available: Optional[Callable[[], None]] = None):
+        """
+        :param on_available: Called when a download completes, a download slot is available
+        """
         self.__logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
         self.__context = context
         self.__staging_path = staging_path
+        self.__on_available = on_available
+        self.__waiting = 0
+        self.__active = 0
+        self.__feed_staging: dict[str, FeedStaging] = dict()
+        self.__feed_locks: dict[str, asyncio.Lock] = dict()
 
         self.__semaphore = asyncio.BoundedSemaphore(threads)
-        self.__current_feedview_downloads: dict[str, asyncio.Event] = dict()
-
-    async def download_feed_data(self, job: ProcessJob):
-        feed_id = job.feed['feed_id']
+        self.__download_semaphore = asyncio.BoundedSemaphore(max(1, context.configuration.download_concurrency))
+        self.__codec = get_codec(context.configuration.staging_codec)
+
+    @property
+    def waiting(self) -> int:
+        """ Number of jobs waiting for a download slot """
+        return self.__waiting
+
+    @property
+    def stats(self) -> dict:
+        return {'downloads_active': self.__active, 'downloads_waiting': self.__waiting}
+
+    def __get_feed_staging(self, feed_id: str) -> FeedStaging:
+        staging = self.__feed_staging.get(feed_id)
+        if staging is None:
+            staging = FeedStaging(pathlib.Path(f'{self.__staging_path}/feed_{feed_id}'))
+            staging.load()
+            self.__feed_staging[feed_id] = staging
+        return staging
+
+    async def __prepare_view(self, staging: FeedStaging, job: ProcessJob):
+        """ Resets the view or imports its state from the per-view staging of previous versions. """
         feed_view_id = job.view['feed_view_id']
-
-        producer = await self.__context.get_producer()
-
-        job.data_file_path = pathlib.Path(f'{self.__staging_path}/feedview_{feed_view_id}.jsonl.gz')
+        data_file_path = pathlib.Path(f'{self.__staging_path}/feedview_{feed_view_id}.staging')
         staging_file_info_path = pathlib.Path(f'{self.__staging_path}/feedview_{feed_view_id}_info.json')
+        legacy_data_file_path = pathlib.Path(f'{self.__staging_path}/feedview_{feed_view_id}.jsonl.gz')
 
-        # Load staging state
-        staging_file_info = dict()
         if job.reset:
             # Reset the local staging area
+            staging.reset_view(feed_view_id)
+            delete_staging(data_file_path)
+            for path in [legacy_data_file_path, staging_file_info_path]:
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+        elif staging.is_known(feed_view_id) is False:
             try:
-                os.unlink(job.data_file_path)
+                with open(staging_file_info_path) as fp:
+                    staging_file_info = json.load(fp)
             except FileNotFoundError:
-                pass
+                staging_file_info = dict()
+            staging.add_view(feed_view_id, staging_file_info.get('cursor'), staging_file_info.get('most_recent_date'))
+            if legacy_data_file_path.exists():
+                # Staging file from a previous version that was not processed
+                await asyncio.to_thread(convert_jsonl_gz, legacy_data_file_path, data_file_path, self.__codec)
+                os.unlink(legacy_data_file_path)
+            if data_file_path.exists():
+                staging.add_segment(feed_view_id, data_file_path)
             try:
                 os.unlink(staging_file_info_path)
             except FileNotFoundError:
                 pass
-        else:
-            try:
-                with open(staging_file_info_path) as fp:
-                    staging_file_info = json.load(fp)
-            except FileNotFoundError:
-                pass
 
-        try:
-            download_event = self.__current_feedview_downloads[feed_view_id]
-            # Download being done in a different thread, do not block other processes trying to download simultaneously
-            await download_event.wait()
-            # Let the process through, will revalidate that all the most recent data was received
-            # or retry if other process failed.
-        except KeyError:
-            pass
+    async def download_feed_data(self, jobs: list[ProcessJob]):
+        """
+        Downloads the new data of a feed once for the views of all the jobs, into a segment of the feed staging.
+        Sets feed_staging and data_cutoff on the jobs.
+        """
+        job = jobs[0]
+        feed_id = job.feed['feed_id']
+        feed_view_id = job.view['feed_view_id']  # Any view of the feed gives access to the feed data
+        feed_view_ids = [j.view['feed_view_id'] for j in jobs]
 
-        # Limit the number of simultaneous downloads
-        async with self.__semaphore:
-            # Fetch all records from start date
-            skip = 0
-            limit = 50
+        producer = await self.__context.get_producer()
 
-            self.__current_feedview_downloads[feed_view_id] = asyncio.Event()
-            download_event = self.__current_feedview_downloads[feed_view_id]
+        # One download at a time per feed
+        self.__waiting += 1
+        waiting = True
+        try:
+            async with self.__feed_locks.setdefault(feed_id, asyncio.Lock()):
+                staging = self.__get_feed_staging(feed_id)
+                for view_job in jobs:
+                    view_job.feed_staging = staging
+                    await self.__prepare_view(staging, view_job)
+                parsed = job.message.parsed
+                if parsed.get('feed_view_ids') is None and parsed.get('feed_view_id') is None:
+                    staging.prune_views(feed_view_ids)  # The jobs cover all the active views
+                staging.save()
+
+                # Limit the number of simultaneous downloads
+                async with self.__semaphore:
+                    self.__waiting -= 1
+                    waiting = False
+                    self.__active += 1
+                    try:
+                        await self.__download_segment(producer, staging, jobs, feed_id, feed_view_id, feed_view_ids)
+                    finally:
+                        self.__active -= 1
+        finally:
+            if waiting:
+                self.__waiting -= 1
+            if self.__on_available is not None:
+                self.__on_available()
+
+    async def __download_segment(self, producer, staging: FeedStaging, jobs: list[ProcessJob],
+                                 feed_id: str, feed_view_id: str, feed_view_ids: list[str]):
+        # Fetch all records from start date
+        configuration = self.__context.configuration
+        page_size = AdaptivePageSize(configuration.feed_page_size_min, configuration.feed_page_size_max)
+
+        # Resume from the oldest position of the views, None when a view starts over
+        start_date, checkpoint_cursor = staging.download_start(feed_view_ids)  # Epoch in milliseconds
+        segment_start = (start_date, checkpoint_cursor)
+        if start_date is not None:
+            most_recent_date: Optional[datetime.datetime] = datetime.datetime.fromtimestamp(start_date / 1000)
+        else:
+            start_date = 0
+            most_recent_date = None
+
+        # Keyset pagination on (save_date, data_id). The checkpoint cursor only moves past items written
+        # to the segment, the page cursor moves as soon as a page is received.
+        cursor_mode = configuration.feed_data_cursor
+        page_cursor = checkpoint_cursor
+        batch_start = page_cursor['save_date'] if page_cursor else start_date
+        skip = 0
+
+        # Keys received during this run, the server may omit them from the following pages
+        keys: dict[str, bytes] = dict()
+
+        def page_request() -> dict:
+            request = {"feed_id": feed_id, "feed_view_id": feed_view_id, "batch_start": batch_start, "limit": page_size.size, "skip": skip}
+            if cursor_mode:
+                request['cursor'] = page_cursor
+            if len(keys) > 0:
+                request['known_key_ids'] = list(keys.keys())
+            return request
+
+        # New segment for the data of this download, shared by the views of the feed that are not behind its start
+        segment_path, segment = staging.open_segment(*segment_start)
+        output_file = await asyncio.to_thread(StagingWriter, segment_path, self.__codec, False)
+        try:
+            next_page: Optional[asyncio.Task] = None
             try:
-                start_date = staging_file_info['most_recent_date']  # Epoch in milliseconds
-                most_recent_date: Optional[datetime.datetime] = datetime.datetime.fromtimestamp(start_date / 1000)
-            except KeyError:
-                start_date = 0
-                most_recent_date = None
-
-            if start_date > 0:
-                open_mode = 'at'  # Append to file
-            else:
-                open_mode = 'wt'  # New file or overwrite
-
-            with gzip.open(job.data_file_path, open_mode) as output_file:
-                try:
-                    while self.__context.stopping is False:
-                        response = await producer.request(
-                            {"feed_id": feed_id, "feed_view_id": feed_view_id, "batch_start": start_date, "limit": limit, "skip": skip},
-                            "DataCollector", "getFeedData", Constantes.SECURITE_PROTEGE)
-
-                        if response.parsed['ok'] is not True:
-                            raise FeedDownloadException(
-                                f'Error received when fetching next batch (code: {response.parsed.get('code')}: {response.parsed.get('err')})')
-
-                        items: list = response.parsed['items']
-                        if len(items) == 0:
-                            break  # Done
-
-                        decrypted_keys_message = dechiffrer_reponse(self.__context.signing_key, response.parsed['keys'])
-                        keys: dict[str, bytes] = dict()
-                        for key in decrypted_keys_message['cles']:
-                            keys[key['cle_id']] = decode_base64_nopad(key['cle_secrete_base64'])
-
-                        skip += len(items)  # For next batch
-                        for item in items:
-                            # Download and save in staging area
+                next_page_time = time.monotonic()
+                next_page = asyncio.create_task(request_feed_data_page(producer, page_request()))
+                while self.__context.stopping is False:
+                    response, latency = await next_page
+                    next_page = None
+
+                    if response.parsed['ok'] is not True:
+                        raise FeedDownloadException(
+                            f'Error received when fetching next batch (code: {response.parsed.get('code')}: {response.parsed.get('err')})')
+
+                    page_items: list = response.parsed['items']
+                    if len(page_items) == 0:
+                        # Done, all the data saved before this request was sent is staged
+                        for job in jobs:
+                            job.data_cutoff = next_page_time
+                        break
+
+                    page_size.update(latency, len(json.dumps(response.parsed)), len(page_items))
+
+                    # Drop items already received (boundary of the previous run or page)
+                    if page_cursor:
+                        items = [item for item in page_items if cursor_key(item) > cursor_key(page_cursor)]
+                    else:
+                        items = page_items
+
+                    if cursor_mode is False:
+                        skip += len(page_items)
+                    elif len(items) == 0:
+                        # The cursor was not applied to the page, fall back to skip/limit for the rest of the run
+                        self.__logger.warning("Feed_id %s view %s getFeedData ignored the cursor, using skip/limit", feed_id, feed_view_id)
+                        cursor_mode = False
+                        skip = len(page_items)
+                    else:
+                        last_item = page_items[-1]
+                        page_cursor = {'save_date': last_item['save_date'], 'data_id': last_item['data_id']}
+                        batch_start = page_cursor['save_date']
+
+                    # Prefetch the next page while the items of this page are being processed
+                    next_page_time = time.monotonic()
+                    next_page = asyncio.create_task(request_feed_data_page(producer, page_request()))
+
+                    if len(items) == 0:
+                        continue
+
+                    try:
+                        page_key_ids = {key_id for item in items for key_id in item['key_ids'] if key_id not in keys}
+                    except (KeyError, TypeError):
+                        page_key_ids = None  # Unknown, decrypt the keys message
+                    if page_key_ids is None or len(page_key_ids) > 0:
+                        keys.update(self.__context.key_cache.decrypt_keys(
+                            self.__context.signing_key, response.parsed.get('keys'), page_key_ids))
+
+                    # Fetch all items of the page concurrently. Results are written to the segment
+                    # in order and the checkpoint only moves past contiguous, completed items.
+                    blob_cache = self.__context.blob_cache
+                    available_items = [item for item in items if blob_cache.is_missing(item['data_fuuid']) is False]
+                    if len(available_items) < len(items):
+                        # Known to be missing from the filehost, do not retry
+                        self.__logger.debug("Feed_id %s view %s skipping %d missing data items",
+                                            feed_id, feed_view_id, len(items) - len(available_items))
+                        items = available_items
+                    fetch_tasks = [asyncio.create_task(self.download_data_item_file(item, keys)) for item in items]
+                    try:
+                        for (item, fetch_task) in zip(items, fetch_tasks):
                             save_date = item['save_date'] / 1000  # To seconds
                             save_date_ts = datetime.datetime.fromtimestamp(save_date)
                             try:
-                                await self.download_data_item_file(job, item, keys, output_file)
-                                if most_recent_date is None or most_recent_date < save_date_ts:
-                                    most_recent_date = save_date_ts
+                                output_content = await fetch_task
                             except KeyError as ke:
                                 self.__logger.warning("Feed_id %s view %s unable to find data_item: %s", feed_id, feed_view_id, ke)
                                 continue
@@ -182,45 +391,79 @@ class FeedDataDownloader:
                                 else:
                                     raise cre
 
-                        if not most_recent_date:
-                            self.__logger.warning("Feed_id %s view %s no data for: %s (HTTP 404)", feed_id, feed_view_id)
-                            continue
-
-                        try:
-                            staging_file_info['most_recent_date'] = math.floor(most_recent_date.timestamp()*1000)
-                        except TypeError:
-                            self.__logger.warning("Unable to find a date for data items in feed_id %s, feed_view_id", feed_id, feed_view_id)
-                            raise FeedDownloadException('Unable to get feed dates')
-                        else:
-                            with open(staging_file_info_path, 'wt') as fp:
-                                json.dump(staging_file_info, fp)
-                except asyncio.TimeoutError:
-                    raise FeedDownloadException('Timeout on getFeedData')
-                finally:
-                    # Release waiting threads
-                    download_event.set()
-                    del self.__current_feedview_downloads[feed_view_id]
-
-    async def download_data_item_file(self, job: ProcessJob, item: dict, keys: dict[str, bytes], output_file) -> (dict, Optional[dict]):
+                            # Views filter the records they already processed with (save_date, data_id)
+                            output_content['save_date'] = item['save_date']
+                            output_content['data_id'] = item['data_id']
+                            await asyncio.to_thread(output_file.write, output_content, item['save_date'],
+                                                    item.get('pub_date_start'), item.get('pub_date_end'))
+                            checkpoint_cursor = {'save_date': item['save_date'], 'data_id': item['data_id']}
+                            if most_recent_date is None or most_recent_date < save_date_ts:
+                                most_recent_date = save_date_ts
+                    except Exception as e:
+                        # Keep the progress made on the contiguous items already written
+                        if most_recent_date:
+                            await asyncio.to_thread(output_file.flush)
+                            staging.checkpoint(segment, math.floor(most_recent_date.timestamp()*1000), checkpoint_cursor)
+                        raise e
+                    finally:
+                        for fetch_task in fetch_tasks:
+                            fetch_task.cancel()
+                        await asyncio.gather(*fetch_tasks, return_exceptions=True)
+
+                    if not most_recent_date:
+                        self.__logger.warning("Feed_id %s view %s no data", feed_id, feed_view_id)
+                        continue
+
+                    await asyncio.to_thread(output_file.flush)
+                    try:
+                        staging.checkpoint(segment, math.floor(most_recent_date.timestamp()*1000), checkpoint_cursor)
+                    except TypeError:
+                        self.__logger.warning("Unable to find a date for data items in feed_id %s, feed_view_id %s", feed_id, feed_view_id)
+                        raise FeedDownloadException('Unable to get feed dates')
+            except asyncio.TimeoutError:
+                raise FeedDownloadException('Timeout on getFeedData')
+            finally:
+                if next_page is not None:
+                    next_page.cancel()
+                    await asyncio.gather(next_page, return_exceptions=True)
+        finally:
+            await asyncio.to_thread(output_file.close)
+            # Makes the segment available to the views, dropped when no data was written
+            staging.close_segment(segment)
+
+    async def download_data_item_file(self, item: dict, keys: dict[str, bytes]) -> dict:
+        """
+        Downloads and decrypts a single data item.
+        :param item: Data item from getFeedData
+        :param keys: Decrypted keys by cle_id
+        :return: Content to write to the staging file
+        """
         fuuid = item['data_fuuid']
-        with tempfile.TemporaryFile('wb+') as temp_file:
+
+        # Decompress the content as it is received in a thread, no temporary file
+        decompressor = zlib.decompressobj()
+        content = bytearray()
+        # Limit the number of simultaneous filehost requests
+        async with self.__download_semaphore:
             try:
-                await self.__context.file_handler.download_file(fuuid, temp_file)
+                async for chunk in self.__context.file_handler.iter_download_file(fuuid):
+                    content += await asyncio.to_thread(decompressor.decompress, chunk)
             except AttributeError as ae:
                 raise FeedDownloadException('Error downloading file: %s' % ae)
-            temp_file.seek(0)
-            content = await asyncio.to_thread(zlib.decompress, temp_file.read())
-            content = content.decode('utf-8')
-            file_content = json.loads(content)
+        content += decompressor.flush()
+        file_content = await asyncio.to_thread(json.loads, content)
+        del content
 
         # Decrypt "encrypted_data", "encrypted_files_map"
-        encrypted_data = file_content['encrypted_data']
+        encrypted_data = file_content.pop('encrypted_data')
         encrypted_files_map = file_content.get('encrypted_files_map')
 
         data_key_id = encrypted_data['cle_id']
         data_key = keys[data_key_id]
         decrypted_data = dechiffrer_bytes_secrete(data_key, encrypted_data)
+        del encrypted_data
         output_content: dict[str, Union[str, dict]] = {'data': decrypted_data.decode('utf-8')}
+        del decrypted_data
 
         if encrypted_files_map:
             files_map = dict()
@@ -241,34 +484,91 @@ class FeedDataDownloader:
 
             output_content['files'] = files_map
 
-        await asyncio.to_thread(json.dump, output_content, output_file)
-        await asyncio.to_thread(output_file.write, '\n')  # Separator for JSONL
+        return output_content
+
+
+async def request_feed_data_page(producer, request: dict) -> (MessageWrapper, float):
+    """
+    Requests a page of feed data.
+    :return: Response and its latency in seconds
+    """
+    start = time.monotonic()
+    response = await producer.request(request, "DataCollector", "getFeedData", Constantes.SECURITE_PROTEGE)
+    return response, time.monotonic() - start
 
 
 class FeedViewProcessorWorker:
 
-    def __init__(self, context: DatasourceMapperContext, data_downloader: FeedDataDownloader, work_queue: asyncio.Queue, worker_id: str):
+    def __init__(self, context: DatasourceMapperContext, data_downloader: FeedDataDownloader, work_queue: FairJobQueue, worker_id: str,
+                 idle_timeout: Optional[float] = None,
+                 may_retire: Optional[Callable[['FeedViewProcessorWorker'], bool]] = None,
+                 scheduler: Optional[CoalescingScheduler] = None,
+                 flights: Optional[SingleFlightGroup] = None):
         self.__logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
         self.__context = context
         self.__data_downloader = data_downloader
         self.__work_queue = work_queue
         self.__worker_id = worker_id
+        self.__idle_timeout = idle_timeout
+        self.__may_retire = may_retire
+        self.__scheduler = scheduler
+        self.__flights = flights or SingleFlightGroup()
 
         self.__current_task: Optional[asyncio.Task] = None
         # self.__current_job: Optional[ProcessJob] = None
+        self.__yielded = False
+
+    @property
+    def worker_id(self) -> str:
+        return self.__worker_id
+
+    @property
+    def busy(self) -> bool:
+        return self.__current_task is not None
+
+    @property
+    def yielded(self) -> bool:
+        """ True while the current job waits for more urgent jobs """
+        return self.__yielded
 
     async def run(self):
         while self.__context.stopping is False:
             # Get next job
-            job = await self.__work_queue.get()
+            if self.__may_retire is not None and self.__idle_timeout:
+                try:
+                    job = await asyncio.wait_for(self.__work_queue.get(), self.__idle_timeout)
+                except asyncio.TimeoutError:
+                    if self.__may_retire(self):
+                        return  # Idle, shut down between jobs
+                    continue
+            else:
+                job = await self.__work_queue.get()
             if self.__context.stopping is True:
                 return  # Stopping
 
             # Run processing task
+            if job is not None:
+                if self.__scheduler is not None:
+                    self.__scheduler.job_started(job)
+                self.__work_queue.job_started(job)
+                job.yield_point = functools.partial(self.__yield_point, job)
             self.__current_task = asyncio.create_task(self.run_job(job))
-            await self.__current_task
-            # self.__current_job = None
-            self.__current_task = None
+            try:
+                await self.__current_task
+            finally:
+                # self.__current_job = None
+                self.__current_task = None
+                if job is not None:
+                    self.__work_queue.job_done(job)
+                    if self.__scheduler is not None:
+                        self.__scheduler.job_done(job)
+
+    async def __yield_point(self, job: ProcessJob):
+        self.__yielded = True
+        try:
+            await self.__work_queue.yield_point(job)
+        finally:
+            self.__yielded = False
 
     async def run_job(self, job: ProcessJob):
         # job = self.__current_job
@@ -286,27 +586,41 @@ class FeedViewProcessorWorker:
             self.__logger.exception("Error preparing feed")
             return
 
+        if len(jobs) == 0:
+            self.__logger.debug(f"{self.__worker_id} No active feed view")
+            return
+
+        # Download the new feed data once for all the views
+        self.__logger.info(f"Downloading feed_id {job.feed['feed_id']} for {len(jobs)} views")
+        try:
+            await self.__data_downloader.download_feed_data(jobs)
+        except FeedDownloadException:
+            self.__logger.exception("Error when downloading feed data")
+            return
+
         for job in jobs:
-            # Download data to staging
-            self.__logger.info(f"Running job on feed_view_id {job.view['feed_view_id']}")
-            try:
-                await self.__data_downloader.download_feed_data(job)
-            except FeedDownloadException:
-                self.__logger.exception("Error when downloading feed data")
+            # Joins the run in progress for the same view when it covers this job
+            if await self.__flights.run(job.view['feed_view_id'], job, self.run_view_job) is False:
                 return
 
-            # Process data and upload to database
-            data_processor = select_data_processor(self.__context, job)
-            await data_processor.process()
+        self.__logger.debug(f"{self.__worker_id} Finishing job")
 
-            # Cleanup - removing data but not the staging info file (allows incremental updates)
-            if job.data_file_path:
-                try:
-                    os.unlink(job.data_file_path)
-                except FileNotFoundError:
-                    pass
+    async def run_view_job(self, job: ProcessJob) -> bool:
+        """ Processes the staged feed data the view has not processed yet. :return: True when done """
+        feed_view_id = job.view['feed_view_id']
+        self.__logger.info(f"Running job on feed_view_id {feed_view_id}")
+        staging = job.feed_staging
+        segment_names = staging.view_segments(feed_view_id)
+        job.staging_paths = [staging.path / name for name in segment_names]
+        job.staging_after = staging.view_cursor(feed_view_id)
 
-        self.__logger.debug(f"{self.__worker_id} Finishing job")
+        # Process data and upload to database
+        data_processor = select_data_processor(self.__context, job)
+        await data_processor.process()
+
+        # Cleanup - segments processed by all the views are removed, the view cursor allows incremental updates
+        staging.consumed(feed_view_id, segment_names)
+        return True
 
     async def get_feed_view_information(self, job: ProcessJob) -> list[ProcessJob]:
         # job = self.__current_job
@@ -339,20 +653,20 @@ class FeedViewProcessorWorker:
             job.feed = feed_response.parsed['feed']
             jobs = list()
 
-            for view in feed_response.parsed['views']:
-                if view.get('active') is False:
-                    continue  # Skip
+            views = [v for v in feed_response.parsed['views'] if v.get('active') is not False]
+
+            # Decrypt the view keys once for all views
+            view_key_ids = [v['encrypted_data']['cle_id'] for v in views]
+            keys = self.__context.key_cache.decrypt_keys(self.__context.signing_key, feed_response.parsed.get('keys'), view_key_ids)
 
+            for view in views:
                 view_job = job.copy()
                 view_job.view = view
 
                 # Decrypt the view key
                 view_job.encryption_key_id = view_job.view['encrypted_data']['cle_id']
-                decrypted_keys_message = dechiffrer_reponse(self.__context.signing_key, feed_response.parsed['keys'])
-                decrypted_keys = decrypted_keys_message['cles']
-                decrypted_key_info = [k for k in decrypted_keys if k['cle_id'] == view_job.encryption_key_id].pop()
-                view_job.encryption_key_str = decrypted_key_info['cle_secrete_base64']
-                view_job.encryption_key = decode_base64_nopad(view_job.encryption_key_str)
+                view_job.encryption_key = keys[view_job.encryption_key_id]
+                view_job.encryption_key_str = encode_base64_nopad(view_job.encryption_key)
 
                 # Decrypt feed view information to test key
                 decrypted_view = dechiffrer_bytes_secrete(view_job.encryption_key, view_job.view['encrypted_data'])
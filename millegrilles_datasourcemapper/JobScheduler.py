@@ -0,0 +1,328 @@
+import asyncio
+import collections
+import logging
+import time
+
+from collections import OrderedDict
+from typing import Awaitable, Callable, Hashable, Optional
+
+from millegrilles_datasourcemapper.DataStructures import ProcessJob, PRIORITY_INTERACTIVE, PRIORITY_UPDATE, \
+    PRIORITY_BULK
+
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: 'interactive', PRIORITY_UPDATE: 'update', PRIORITY_BULK: 'bulk'}
+CONST_USAGE_HALF_LIFE = 600.0  # Seconds
+
+
+def job_key(job: ProcessJob) -> Hashable:
+    """ :return: Feed and views targeted by the job message, None for the views means all the active views. """
+    parsed = job.message.parsed
+    feed_view_ids = parsed.get('feed_view_ids')
+    if feed_view_ids is None and parsed.get('feed_view_id') is not None:
+        feed_view_ids = [parsed['feed_view_id']]
+    if feed_view_ids is not None:
+        feed_view_ids = tuple(sorted(feed_view_ids))
+    return parsed['feed_id'], feed_view_ids
+
+
+class CoalescingScheduler:
+    """
+    Merges the triggers for the same feed views before they reach the process queue.
+    A trigger for a job that is waiting merges into it. A trigger for a running job schedules a single
+    follow-up run once it completes. Update triggers wait for the debounce delay before being queued,
+    reset requests are queued right away.
+    """
+
+    def __init__(self, queue: 'FairJobQueue', debounce: float, on_enqueue: Optional[Callable[[], None]] = None):
+        self.__logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.__queue = queue
+        self.__debounce = debounce
+        self.__on_enqueue = on_enqueue
+        self.__pending: dict[Hashable, ProcessJob] = dict()  # Debouncing or queued, not started
+        self.__queued: set[Hashable] = set()
+        self.__running: set[Hashable] = set()
+        self.__follow_ups: dict[Hashable, ProcessJob] = dict()  # Triggered while running
+        self.__tasks: set[asyncio.Task] = set()
+        self.__merged = 0
+
+    @property
+    def stats(self) -> dict:
+        return {'pending': len(self.__pending), 'running': len(self.__running),
+                'follow_ups': len(self.__follow_ups), 'merged': self.__merged}
+
+    def submit(self, job: ProcessJob):
+        key = job_key(job)
+        job.schedule_key = key
+        if key in self.__running:
+            self.__follow_ups[key] = self.__merge(self.__follow_ups.get(key), job)
+        elif key in self.__pending:
+            self.__pending[key] = self.__merge(self.__pending[key], job)
+            if job.reset:
+                self.__schedule(key, 0)  # Skip the rest of the debounce delay
+        else:
+            self.__pending[key] = job
+            self.__schedule(key, 0 if job.reset else self.__debounce)
+
+    def job_started(self, job: ProcessJob):
+        key = job.schedule_key
+        self.__pending.pop(key, None)
+        self.__queued.discard(key)
+        self.__running.add(key)
+
+    def job_done(self, job: ProcessJob):
+        key = job.schedule_key
+        self.__running.discard(key)
+        follow_up = self.__follow_ups.pop(key, None)
+        if follow_up is not None:
+            self.__pending[key] = follow_up
+            self.__schedule(key, 0 if follow_up.reset else self.__debounce)
+
+    def cancel(self):
+        for task in self.__tasks:
+            task.cancel()
+
+    def __merge(self, current: Optional[ProcessJob], job: ProcessJob) -> ProcessJob:
+        """ Merges into the job already waiting, which may be in the queue. Keeps the latest message and any reset. """
+        if current is None:
+            return job
+        self.__merged += 1
+        current.message = job.message
+        current.reset = current.reset or job.reset
+        current.triggered = max(current.triggered, job.triggered)
+        if job.priority < current.priority:
+            self.__queue.update_priority(current, job.priority)
+        return current
+
+    def __schedule(self, key: Hashable, delay: float):
+        task = asyncio.create_task(self.__enqueue(key, delay))
+        self.__tasks.add(task)
+        task.add_done_callback(self.__tasks.discard)
+
+    async def __enqueue(self, key: Hashable, delay: float):
+        if delay > 0:
+            await asyncio.sleep(delay)
+        job = self.__pending.get(key)
+        if job is None or key in self.__queued:
+            return  # Started or already queued
+        self.__queued.add(key)
+        await self.__queue.put(job)  # Waits for room, the trigger is not lost
+        if self.__on_enqueue is not None:
+            self.__on_enqueue()
+
+
+class FairJobQueue:
+    """
+    Process queue with priority classes (interactive, update, bulk). The most urgent class is served first.
+    Within a class, the feed that used the least processing time recently goes first, FIFO for a feed.
+    Running jobs call yield_point() at batch boundaries: a job running longer than the time slice is
+    demoted to bulk, and it waits there while more urgent jobs are queued so they can take its worker.
+    Same interface as asyncio.Queue for put, put_nowait, get and qsize. None is a stop signal served first.
+    """
+
+    def __init__(self, maxsize: int, time_slice: float, on_yield: Optional[Callable[[], None]] = None,
+                 usage_half_life: float = CONST_USAGE_HALF_LIFE):
+        self.__logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.maxsize = maxsize
+        self.__time_slice = time_slice
+        self.__on_yield = on_yield
+        self.__usage_half_life = usage_half_life
+        self.__classes: dict[int, OrderedDict[str, collections.deque[ProcessJob]]] = {
+            p: OrderedDict() for p in sorted(PRIORITY_NAMES.keys())}
+        self.__count = 0
+        self.__stop_signals = 0
+        self.__waiters: list[asyncio.Future] = list()
+        self.__usage: dict[str, tuple[float, float]] = dict()  # feed_id: (seconds, last update)
+        self.__started: dict[int, tuple[float, float]] = dict()  # id(job): (start, last accounted)
+        self.__yields = 0
+
+    @property
+    def stats(self) -> dict:
+        stats = {'queued_' + PRIORITY_NAMES[p]: sum(len(j) for j in feeds.values()) for (p, feeds) in self.__classes.items()}
+        stats['yields'] = self.__yields
+        return stats
+
+    def qsize(self) -> int:
+        return self.__count
+
+    def empty(self) -> bool:
+        return self.__count == 0 and self.__stop_signals == 0
+
+    def full(self) -> bool:
+        return 0 < self.maxsize <= self.__count
+
+    def put_nowait(self, job: Optional[ProcessJob]):
+        if job is None:
+            self.__stop_signals += 1
+        elif self.full():
+            raise asyncio.QueueFull()
+        else:
+            self.__classes[job.priority].setdefault(_feed_id(job), collections.deque()).append(job)
+            self.__count += 1
+        self.__notify()
+
+    async def put(self, job: Optional[ProcessJob]):
+        while job is not None and self.full():
+            await self.__wait_change()
+        self.put_nowait(job)
+
+    async def get(self) -> Optional[ProcessJob]:
+        while self.empty():
+            await self.__wait_change()
+        if self.__stop_signals > 0:
+            self.__stop_signals -= 1
+            return None
+        job = self.__pop()
+        self.__notify()
+        return job
+
+    def update_priority(self, job: ProcessJob, priority: int):
+        """ Changes the priority of a job, moving it to its new class when it is queued. """
+        feed_id = _feed_id(job)
+        jobs = self.__classes[job.priority].get(feed_id)
+        if jobs is not None and job in jobs:
+            jobs.remove(job)
+            if len(jobs) == 0:
+                del self.__classes[job.priority][feed_id]
+            self.__classes[priority].setdefault(feed_id, collections.deque()).append(job)
+            self.__notify()
+        job.priority = priority
+
+    def job_started(self, job: ProcessJob):
+        now = time.monotonic()
+        self.__started[id(job)] = (now, now)
+
+    def job_done(self, job: ProcessJob):
+        self.__account(job)
+        self.__started.pop(id(job), None)
+
+    async def yield_point(self, job: ProcessJob):
+        """ Called by a running job between batches. """
+        self.__account(job)
+        try:
+            start = self.__started[id(job)][0]
+        except KeyError:
+            return  # Not started through this queue
+        if job.priority != PRIORITY_BULK and time.monotonic() - start > self.__time_slice:
+            self.__logger.debug("Feed %s ran for more than %.0fs, moving to bulk priority", _feed_id(job), self.__time_slice)
+            job.priority = PRIORITY_BULK
+
+        if self.__more_urgent_queued(job.priority):
+            self.__yields += 1
+            if self.__on_yield is not None:
+                self.__on_yield()  # Gives the worker slot of this job to the queued jobs
+            while self.__more_urgent_queued(job.priority):
+                await self.__wait_change()
+            self.__account(job)  # Time spent waiting is not counted as usage
+
+    def __more_urgent_queued(self, priority: int) -> bool:
+        return any(len(self.__classes[p]) > 0 for p in self.__classes.keys() if p < priority)
+
+    def __account(self, job: ProcessJob):
+        """ Adds the processing time since the last call to the usage of the feed. """
+        try:
+            start, last = self.__started[id(job)]
+        except KeyError:
+            return
+        now = time.monotonic()
+        self.__started[id(job)] = (start, now)
+        feed_id = _feed_id(job)
+        self.__usage[feed_id] = (self.__feed_usage(feed_id, now) + now - last, now)
+
+    def __feed_usage(self, feed_id: str, now: float) -> float:
+        try:
+            seconds, updated = self.__usage[feed_id]
+        except KeyError:
+            return 0.0
+        return seconds * 0.5 ** ((now - updated) / self.__usage_half_life)
+
+    def __pop(self) -> ProcessJob:
+        now = time.monotonic()
+        for feeds in self.__classes.values():
+            if len(feeds) == 0:
+                continue
+            feed_id = min(feeds.keys(), key=lambda f: self.__feed_usage(f, now))
+            jobs = feeds[feed_id]
+            job = jobs.popleft()
+            if len(jobs) == 0:
+                del feeds[feed_id]
+            else:
+                feeds.move_to_end(feed_id)  # Round robin between feeds with the same usage
+            self.__count -= 1
+            return job
+        raise asyncio.QueueEmpty()
+
+    async def __wait_change(self):
+        waiter = asyncio.get_running_loop().create_future()
+        self.__waiters.append(waiter)
+        try:
+            await waiter
+        finally:
+            try:
+                self.__waiters.remove(waiter)
+            except ValueError:
+                pass
+
+    def __notify(self):
+        waiters = self.__waiters
+        self.__waiters = list()
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+
+def _feed_id(job: ProcessJob) -> str:
+    return job.message.parsed['feed_id']
+
+
+class SingleFlightGroup:
+    """
+    One run at a time per feed view. A job for a view that is already running waits for that run and
+    shares its result when the run covers it: the run staged all the data saved before the job was triggered
+    and it is a reset when the job is a reset. Otherwise the job runs after it, as a follow-up.
+    """
+
+    def __init__(self):
+        self.__flights: dict[str, asyncio.Future] = dict()
+        self.__jobs: dict[str, ProcessJob] = dict()
+        self.__runs = 0
+        self.__shared = 0
+
+    @property
+    def stats(self) -> dict:
+        return {'flights': len(self.__flights), 'runs': self.__runs, 'shared': self.__shared}
+
+    async def run(self, feed_view_id: str, job: ProcessJob, run: Callable[[ProcessJob], Awaitable[bool]]) -> bool:
+        """
+        :param feed_view_id: View key
+        :param job: Job of the view
+        :param run: Runs the job, returns True on success
+        :return: Result of the run that covered the job
+        """
+        while True:
+            flight = self.__flights.get(feed_view_id)
+            if flight is None:
+                break
+            flight_job = self.__jobs[feed_view_id]
+            success = await asyncio.shield(flight)
+            if success and _covers(flight_job, job):
+                self.__shared += 1
+                return True
+            # Not covered, check again since another job may have started a new run
+
+        flight = asyncio.get_running_loop().create_future()
+        self.__flights[feed_view_id] = flight
+        self.__jobs[feed_view_id] = job
+        self.__runs += 1
+        success = False
+        try:
+            success = await run(job)
+            return success
+        finally:
+            del self.__flights[feed_view_id]
+            del self.__jobs[feed_view_id]
+            flight.set_result(success)
+
+
+def _covers(flight_job: ProcessJob, job: ProcessJob) -> bool:
+    if job.reset and not flight_job.reset:
+        return False
+    return flight_job.data_cutoff is not None and job.triggered <= flight_job.data_cutoff
@@ -0,0 +1,82 @@
+import logging
+import time
+
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+from millegrilles_messages.chiffrage.DechiffrageUtils import dechiffrer_reponse
+from millegrilles_datasourcemapper.Util import decode_base64_nopad
+
+
+class DecryptedKeyCache:
+    """
+    Process-wide cache of decrypted secret keys by cle_id.
+    Avoids the asymmetric decryption of keys messages when all the required keys are already known.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.__logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.__max_size = max(1, max_size)
+        self.__ttl = ttl
+        self.__keys: OrderedDict[str, tuple[bytes, float]] = OrderedDict()  # cle_id: (secret_key, expiration)
+        self.__hits = 0
+        self.__misses = 0
+
+    @property
+    def stats(self) -> dict:
+        return {'hits': self.__hits, 'misses': self.__misses, 'size': len(self.__keys)}
+
+    def get(self, key_id: str) -> Optional[bytes]:
+        try:
+            secret_key, expiration = self.__keys[key_id]
+        except KeyError:
+            self.__misses += 1
+            return None
+
+        if expiration < time.monotonic():
+            del self.__keys[key_id]
+            self.__misses += 1
+            return None
+
+        self.__keys.move_to_end(key_id)
+        self.__hits += 1
+        return secret_key
+
+    def put(self, key_id: str, secret_key: bytes):
+        self.__keys[key_id] = (secret_key, time.monotonic() + self.__ttl)
+        self.__keys.move_to_end(key_id)
+        while len(self.__keys) > self.__max_size:
+            self.__keys.popitem(last=False)
+
+    def decrypt_keys(self, signing_key, encrypted_keys: Optional[dict], key_ids: Optional[Iterable[str]] = None) -> dict[str, bytes]:
+        """
+        Returns the secret keys, decrypting the keys message only when some of the keys are not cached.
+        :param signing_key: Instance signing key used to decrypt the keys message
+        :param encrypted_keys: Encrypted keys message, may be None when the keys were not provided
+        :param key_ids: Required key ids. When None, the keys message is always decrypted.
+        :return: Secret keys by cle_id, the cached keys and the keys of the message
+        """
+        keys: dict[str, bytes] = dict()
+        if key_ids is not None:
+            missing_key_ids = list()
+            for key_id in key_ids:
+                secret_key = self.get(key_id)
+                if secret_key is None:
+                    missing_key_ids.append(key_id)
+                else:
+                    keys[key_id] = secret_key
+            if len(missing_key_ids) == 0:
+                return keys  # All keys were cached
+
+        if encrypted_keys is None:
+            if key_ids is not None:
+                self.__logger.debug("Keys %s not cached and no keys message to decrypt", missing_key_ids)
+            return keys  # Nothing else to decrypt
+
+        decrypted_keys_message = dechiffrer_reponse(signing_key, encrypted_keys)
+        for key in decrypted_keys_message['cles']:
+            secret_key = decode_base64_nopad(key['cle_secrete_base64'])
+            self.put(key['cle_id'], secret_key)
+            keys[key['cle_id']] = secret_key
+
+        return keys
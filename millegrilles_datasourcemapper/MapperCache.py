@@ -0,0 +1,147 @@
+import hashlib
+import importlib.util
+import logging
+import marshal
+import os
+import pathlib
+import time
+
+from collections import OrderedDict
+from typing import Callable, Optional
+
+
+def hash_mapping_code(mapping_code: str) -> str:
+    return hashlib.blake2s(mapping_code.encode('utf-8')).hexdigest()
+
+
+class CompiledMapper:
+    """ Mapper module compiled and executed once, shared by all the items it parses. """
+
+    def __init__(self, code_hash: str, namespace: dict, compile_time: float, exec_time: float, from_bytecode: bool):
+        self.code_hash = code_hash
+        self.namespace = namespace
+        self.compile_time = compile_time
+        """ Seconds spent compiling (or loading the bytecode) """
+        self.exec_time = exec_time
+        """ Seconds spent executing the module body """
+        self.from_bytecode = from_bytecode
+
+    @property
+    def parse(self) -> Callable:
+        return self.namespace['parse']
+
+
+class MapperCache:
+    """
+    LRU cache of compiled and executed mapper modules keyed by the hash of the mapping code.
+    Optionally keeps the compiled bytecode on disk to skip compilation after a restart.
+    """
+
+    def __init__(self, max_size: int, bytecode_path: Optional[pathlib.Path] = None):
+        self.__logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.__max_size = max(1, max_size)
+        self.__bytecode_path = bytecode_path
+        self.__mappers: OrderedDict[str, CompiledMapper] = OrderedDict()
+        self.__hits = 0
+        self.__misses = 0
+        self.__view_stats: dict[str, dict] = dict()  # feed_view_id: stats
+
+    @property
+    def stats(self) -> dict:
+        return {'hits': self.__hits, 'misses': self.__misses, 'size': len(self.__mappers)}
+
+    def view_stats(self, feed_view_id: str) -> Optional[dict]:
+        """ :return: hits, misses and cumulative compile/exec time of the mapper of a view """
+        return self.__view_stats.get(feed_view_id)
+
+    def record_view_stats(self, feed_view_id: str, cached: bool, compile_time: float, exec_time: float):
+        """ Adds a mapper lookup to the statistics of a view, also used for lookups done in the worker processes. """
+        view_stats = self.__view_stats.setdefault(
+            feed_view_id, {'hits': 0, 'misses': 0, 'compile_time': 0.0, 'exec_time': 0.0})
+        if cached:
+            view_stats['hits'] += 1
+        else:
+            view_stats['misses'] += 1
+            view_stats['compile_time'] += compile_time
+            view_stats['exec_time'] += exec_time
+
+    def get(self, mapping_code: str, feed_view_id: Optional[str] = None) -> (CompiledMapper, bool):
+        """
+        :param mapping_code: Python source of the mapper
+        :param feed_view_id: View using the mapper, for statistics
+        :return: Compiled mapper, True when it came from the cache
+        """
+        code_hash = hash_mapping_code(mapping_code)
+        try:
+            mapper = self.__mappers[code_hash]
+        except KeyError:
+            pass
+        else:
+            self.__mappers.move_to_end(code_hash)
+            self.__hits += 1
+            if feed_view_id is not None:
+                self.record_view_stats(feed_view_id, True, mapper.compile_time, mapper.exec_time)
+            return mapper, True
+
+        self.__misses += 1
+        mapper = self.__load(mapping_code, code_hash)
+        if feed_view_id is not None:
+            self.record_view_stats(feed_view_id, False, mapper.compile_time, mapper.exec_time)
+        self.__mappers[code_hash] = mapper
+        while len(self.__mappers) > self.__max_size:
+            self.__mappers.popitem(last=False)
+        return mapper, False
+
+    def __load(self, mapping_code: str, code_hash: str) -> CompiledMapper:
+        start = time.perf_counter()
+        code = self.__load_bytecode(code_hash)
+        from_bytecode = code is not None
+        if code is None:
+            code = compile(mapping_code, '<string>', 'exec')
+            self.__save_bytecode(code_hash, code)
+        compile_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        namespace = {}  # Module context
+        exec(code, namespace)
+        exec_time = time.perf_counter() - start
+
+        return CompiledMapper(code_hash, namespace, compile_time, exec_time, from_bytecode)
+
+    def __get_bytecode_file(self, code_hash: str) -> Optional[pathlib.Path]:
+        if self.__bytecode_path is None:
+            return None
+        return self.__bytecode_path / f'{code_hash}.bin'
+
+    def __load_bytecode(self, code_hash: str):
+        bytecode_file = self.__get_bytecode_file(code_hash)
+        if bytecode_file is None:
+            return None
+        try:
+            with open(bytecode_file, 'rb') as fp:
+                content = fp.read()
+        except FileNotFoundError:
+            return None
+
+        magic = importlib.util.MAGIC_NUMBER
+        if content[:len(magic)] != magic:
+            return None  # Compiled by a different python version
+        try:
+            return marshal.loads(content[len(magic):])
+        except (EOFError, ValueError, TypeError):
+            self.__logger.warning("Invalid bytecode cache file %s, ignored", bytecode_file)
+            return None
+
+    def __save_bytecode(self, code_hash: str, code):
+        bytecode_file = self.__get_bytecode_file(code_hash)
+        if bytecode_file is None:
+            return
+        try:
+            bytecode_file.parent.mkdir(parents=True, exist_ok=True)
+            temp_file = pathlib.Path(f'{bytecode_file}.tmp')
+            with open(temp_file, 'wb') as fp:
+                fp.write(importlib.util.MAGIC_NUMBER)
+                fp.write(marshal.dumps(code))
+            os.replace(temp_file, bytecode_file)
+        except OSError:
+            self.__logger.exception("Error saving bytecode cache file %s", bytecode_file)
@@ -0,0 +1,207 @@
+import asyncio
+import logging
+import multiprocessing
+import pathlib
+import signal
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from millegrilles_datasourcemapper.MapperCache import MapperCache
+
+# Mapper code runs in worker processes to keep CPU heavy parsing off the event loop.
+# Each worker keeps its own cache of compiled mappers. Data items are sent in batches and
+# the parsed items are returned serialized (DatedItemData.to_dict), one result per data item.
+
+CONST_WORKER_MAPPER_CACHE_SIZE = 16
+CONST_BUDGET_REPEAT = 0.1  # Seconds between signals once a budget is exceeded
+
+
+class MapperBudgetExceeded(BaseException):
+    """ Not an Exception, mapper code catching Exception per item does not swallow it. """
+    pass
+
+
+# Worker process state, set by _init_worker
+_worker_cache: Optional[MapperCache] = None
+_worker_cpu_budget: Optional[float] = None
+_worker_timeout: Optional[float] = None
+
+
+def _init_worker(bytecode_path: Optional[pathlib.Path], cpu_budget: Optional[float], timeout: Optional[float]):
+    global _worker_cache, _worker_cpu_budget, _worker_timeout
+    _worker_cache = MapperCache(CONST_WORKER_MAPPER_CACHE_SIZE, bytecode_path)
+    _worker_cpu_budget = cpu_budget
+    _worker_timeout = timeout
+    if hasattr(signal, 'setitimer'):
+        signal.signal(signal.SIGPROF, _budget_exceeded)
+        signal.signal(signal.SIGALRM, _budget_exceeded)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Shutdown is handled by the parent process
+
+
+def _budget_exceeded(signum, _frame):
+    if signum == signal.SIGPROF:
+        raise MapperBudgetExceeded('CPU budget of %s seconds exceeded' % _worker_cpu_budget)
+    raise MapperBudgetExceeded('Timeout of %s seconds exceeded' % _worker_timeout)
+
+
+def _set_timers(enabled: bool):
+    if not hasattr(signal, 'setitimer'):
+        return  # Budgets not supported on this platform
+    # The timers repeat until disabled, a signal caught by the mapper code does not lift the budget
+    if _worker_cpu_budget:
+        signal.setitimer(signal.ITIMER_PROF, _worker_cpu_budget if enabled else 0, CONST_BUDGET_REPEAT if enabled else 0)
+    if _worker_timeout:
+        signal.setitimer(signal.ITIMER_REAL, _worker_timeout if enabled else 0, CONST_BUDGET_REPEAT if enabled else 0)
+
+
+async def _parse_items(parse, data_items: list[str]) -> list[dict]:
+    results = list()
+    for data_item in data_items:
+        _set_timers(True)
+        try:
+            items = [item.to_dict() async for item in parse(data_item)]
+            _set_timers(False)
+            results.append({'items': items})
+        except MapperBudgetExceeded as e:
+            _set_timers(False)
+            results.append({'error': str(e)})
+        except Exception as e:
+            _set_timers(False)
+            results.append({'error': '%s: %s' % (e.__class__.__name__, e)})
+    return results
+
+
+def parse_in_worker(mapping_code: str, data_items: list[str]) -> (list[dict], Optional[dict]):
+    """
+    Runs the mapper on a batch of data items. Executed in a worker process.
+    :return: One result per data item, either {'items': [serialized items]} or {'error': str}.
+             Mapper load statistics (cached, compile_time, exec_time), None when the mapper did not load.
+    """
+    try:
+        mapper, cached = _worker_cache.get(mapping_code)
+        parse = mapper.parse
+    except Exception as e:
+        error = {'error': 'Error loading mapper, %s: %s' % (e.__class__.__name__, e)}
+        return [error for _ in data_items], None
+    load_stats = {'cached': cached, 'compile_time': mapper.compile_time, 'exec_time': mapper.exec_time}
+
+    try:
+        return asyncio.run(_parse_items(parse, data_items)), load_stats
+    except MapperBudgetExceeded as e:
+        # Interrupted outside of the mapper code, the whole batch is lost
+        _set_timers(False)
+        return [{'error': str(e)} for _ in data_items], load_stats
+
+
+def _start_method() -> str:
+    """ Workers are not forked from the event loop process, it runs threads (to_thread, bus connection). """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return 'forkserver'
+    return 'spawn'
+
+
+def _kill_workers(executor: ProcessPoolExecutor):
+    kill_workers = getattr(executor, 'kill_workers', None)  # python 3.14+
+    if kill_workers is not None:
+        kill_workers()
+        return
+    for process in list((getattr(executor, '_processes', None) or dict()).values()):
+        process.kill()
+
+
+class MapperProcessPool:
+    """
+    Pool of worker processes running mapper parse functions under a CPU and time budget.
+    A worker that stops responding is killed with the rest of the pool, which is replaced.
+    """
+
+    def __init__(self, processes: int, batch_items: int, cpu_budget: Optional[float], timeout: Optional[float],
+                 bytecode_path: Optional[pathlib.Path] = None, mapper_cache: Optional[MapperCache] = None):
+        """
+        :param mapper_cache: Cache of the parent process, receives the mapper statistics of the views
+        """
+        self.__logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.__processes = max(1, processes)
+        self.__batch_items = max(1, batch_items)
+        self.__timeout = timeout
+        self.__initargs = (bytecode_path, cpu_budget, timeout)
+        self.__mapper_cache = mapper_cache
+        self.__restarts = 0
+        self.__in_flight = 0
+        self.__executor = self.__create_executor()
+
+    def __create_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.__processes, mp_context=multiprocessing.get_context(_start_method()),
+                                   initializer=_init_worker, initargs=self.__initargs)
+
+    def __restart(self, executor: ProcessPoolExecutor):
+        """ Replaces the executor, killing its workers. No effect when it was already replaced. """
+        if executor is not self.__executor:
+            return
+        self.__restarts += 1
+        self.__executor = self.__create_executor()
+        _kill_workers(executor)
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    @property
+    def processes(self) -> int:
+        return self.__processes
+
+    @property
+    def batch_items(self) -> int:
+        """ Number of data items sent to a worker in one call """
+        return self.__batch_items
+
+    @property
+    def restarts(self) -> int:
+        return self.__restarts
+
+    @property
+    def utilization(self) -> float:
+        """ Batches in flight per worker process, 1.0 and more when all the workers are busy """
+        return self.__in_flight / self.__processes
+
+    async def parse(self, mapping_code: str, data_items: list[str], feed_view_id: Optional[str] = None) -> list[dict]:
+        """
+        Parses a batch of data items in a worker process.
+        :param feed_view_id: View using the mapper, for statistics
+        :return: One result per data item, either {'items': [serialized items]} or {'error': str}
+        """
+        self.__in_flight += 1
+        try:
+            return await self.__parse(mapping_code, data_items, feed_view_id)
+        finally:
+            self.__in_flight -= 1
+
+    async def __parse(self, mapping_code: str, data_items: list[str], feed_view_id: Optional[str]) -> list[dict]:
+        loop = asyncio.get_running_loop()
+        for attempt in range(0, 2):
+            executor = self.__executor
+            future = loop.run_in_executor(executor, parse_in_worker, mapping_code, data_items)
+            try:
+                if self.__timeout is None:
+                    results, load_stats = await future
+                else:
+                    # The worker enforces the timeout on each item, this only guards against a stuck worker
+                    results, load_stats = await asyncio.wait_for(future, self.__timeout * len(data_items) + 30)
+            except asyncio.TimeoutError:
+                self.__logger.error("Mapper worker did not respond for a batch of %d items, restarting the pool", len(data_items))
+                self.__restart(executor)
+                return [{'error': 'Worker timeout'} for _ in data_items]
+            except BrokenProcessPool:
+                # A worker died, or the pool was restarted while the batch was running. Retried once.
+                self.__restart(executor)
+                if attempt > 0:
+                    self.__logger.error("Mapper worker pool failed on a batch of %d items", len(data_items))
+                    return [{'error': 'Worker pool failure'} for _ in data_items]
+                continue
+
+            if self.__mapper_cache is not None and feed_view_id is not None and load_stats is not None:
+                self.__mapper_cache.record_view_stats(feed_view_id, load_stats['cached'],
+                                                      load_stats['compile_time'], load_stats['exec_time'])
+            return results
+
+    def shutdown(self):
+        self.__executor.shutdown(wait=False, cancel_futures=True)
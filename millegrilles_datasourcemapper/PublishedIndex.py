@@ -0,0 +1,144 @@
+import hashlib
+import logging
+import math
+import os
+import pathlib
+
+from typing import Iterable
+
+# data_ids are hex blake2s-256 digests, stored as 32 byte records in a sorted file.
+RECORD_SIZE = 32
+CONST_BLOOM_ERROR_RATE = 0.01
+CONST_BLOOM_MIN_CAPACITY = 1024
+
+
+def data_id_to_record(data_id: str) -> bytes:
+    try:
+        record = bytes.fromhex(data_id)
+        if len(record) == RECORD_SIZE:
+            return record
+    except ValueError:
+        pass
+    return hashlib.blake2s(data_id.encode('utf-8')).digest()
+
+
+class BloomFilter:
+
+    def __init__(self, capacity: int, error_rate: float = CONST_BLOOM_ERROR_RATE):
+        self.capacity = max(1, capacity)
+        self.__bit_count = max(8, int(-self.capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.__hash_count = max(1, round(self.__bit_count / self.capacity * math.log(2)))
+        self.__bits = bytearray((self.__bit_count + 7) // 8)
+
+    def __positions(self, record: bytes):
+        # Records are already uniformly distributed digests, use double hashing on two slices
+        h1 = int.from_bytes(record[0:8], 'little')
+        h2 = int.from_bytes(record[8:16], 'little') | 1
+        for i in range(self.__hash_count):
+            yield (h1 + i * h2) % self.__bit_count
+
+    def add(self, record: bytes):
+        for position in self.__positions(record):
+            self.__bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, record: bytes) -> bool:
+        for position in self.__positions(record):
+            if self.__bits[position >> 3] & (1 << (position & 7)) == 0:
+                return False
+        return True
+
+
+class PublishedIdIndex:
+    """
+    data_ids already published to a feed view. Used to skip items DataCollector already has.
+    The sorted file is searched in memory, behind a Bloom filter. New ids are merged on save().
+    """
+
+    def __init__(self, path: pathlib.Path):
+        self.__logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.__path = path
+        self.__records = b''
+        self.__pending: set[bytes] = set()
+        self.__bloom = BloomFilter(CONST_BLOOM_MIN_CAPACITY)
+
+    def __len__(self):
+        return len(self.__records) // RECORD_SIZE + len(self.__pending)
+
+    def load(self):
+        """ Blocking, run in a thread. """
+        try:
+            with open(self.__path, 'rb') as fp:
+                records = fp.read()
+        except FileNotFoundError:
+            records = b''
+        if len(records) % RECORD_SIZE != 0:
+            self.__logger.warning("Corrupted published index %s, rebuilding", self.__path)
+            records = b''
+        self.__records = records
+        self.__pending.clear()
+        self.__rebuild_bloom()
+
+    def clear(self):
+        """ Drops all ids, for example when the view gets truncated. Blocking, run in a thread. """
+        try:
+            os.unlink(self.__path)
+        except FileNotFoundError:
+            pass
+        self.__records = b''
+        self.__pending.clear()
+        self.__rebuild_bloom()
+
+    def contains(self, data_id: str) -> bool:
+        record = data_id_to_record(data_id)
+        if record not in self.__bloom:
+            return False
+        if record in self.__pending:
+            return True
+        return self.__search(record)
+
+    def add(self, data_ids: Iterable[str]):
+        for data_id in data_ids:
+            record = data_id_to_record(data_id)
+            self.__pending.add(record)
+            self.__bloom.add(record)
+        if len(self) > self.__bloom.capacity:
+            self.__rebuild_bloom()
+
+    def save(self):
+        """ Merges the new ids in the sorted file. Blocking, run in a thread. """
+        if len(self.__pending) == 0:
+            return
+        existing = [self.__records[i:i + RECORD_SIZE] for i in range(0, len(self.__records), RECORD_SIZE)]
+        records = b''.join(sorted(set(existing).union(self.__pending)))
+
+        self.__path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = pathlib.Path(f'{self.__path}.tmp')
+        with open(temp_path, 'wb') as fp:
+            fp.write(records)
+        os.replace(temp_path, self.__path)
+
+        self.__records = records
+        self.__pending.clear()
+
+    def __search(self, record: bytes) -> bool:
+        records = self.__records
+        low, high = 0, len(records) // RECORD_SIZE
+        while low < high:
+            middle = (low + high) // 2
+            offset = middle * RECORD_SIZE
+            value = records[offset:offset + RECORD_SIZE]
+            if value == record:
+                return True
+            elif value < record:
+                low = middle + 1
+            else:
+                high = middle
+        return False
+
+    def __rebuild_bloom(self):
+        self.__bloom = BloomFilter(max(CONST_BLOOM_MIN_CAPACITY, 2 * len(self)))
+        records = self.__records
+        for i in range(0, len(records), RECORD_SIZE):
+            self.__bloom.add(records[i:i + RECORD_SIZE])
+        for record in self.__pending:
+            self.__bloom.add(record)
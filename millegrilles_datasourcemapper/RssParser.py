@@ -0,0 +1,263 @@
+import time
+import xml.etree.ElementTree as ET
+
+from typing import Iterator, Optional, Union
+
+from millegrilles_datasourcemapper.DataParserUtilities import iter_xml_items, parse_date_epoch
+
+# Lightweight RSS 2.0 / RSS 1.0 / Atom / media RSS parser. Entries have the same keys as feedparser
+# for the fields used by the mappers. Unlike feedparser, html is not sanitized unless requested (sanitize=True)
+# and relative urls are not resolved.
+
+NS_ATOM = 'http://www.w3.org/2005/Atom'
+NS_RSS1 = 'http://purl.org/rss/1.0/'
+NS_DC = 'http://purl.org/dc/elements/1.1/'
+NS_CONTENT = 'http://purl.org/rss/1.0/modules/content/'
+NS_MEDIA = 'http://search.yahoo.com/mrss/'
+NS_XML = 'http://www.w3.org/XML/1998/namespace'
+NS_RDF = 'http://www.w3.org/1999/02/22-rdf-syntax-ns#'
+
+ATOM_TEXT_TYPES = {'text': 'text/plain', 'html': 'text/html', 'xhtml': 'application/xhtml+xml'}
+HTML_TYPES = ('text/html', 'application/xhtml+xml')
+
+
+class FeedEntry(dict):
+    """ Dict with attribute access, similar to feedparser.FeedParserDict. """
+
+    keymap = {
+        'description': 'summary',
+        'description_detail': 'summary_detail',
+        'guid': 'id',
+        'date': 'updated',
+        'date_parsed': 'updated_parsed',
+        'updated': 'published',
+        'updated_parsed': 'published_parsed',
+    }
+
+    def __getitem__(self, key):
+        try:
+            return dict.__getitem__(self, key)
+        except KeyError:
+            mapped_key = self.keymap.get(key)
+            if mapped_key is None:
+                raise
+            return self[mapped_key]
+
+    def __contains__(self, key):
+        if dict.__contains__(self, key):
+            return True
+        mapped_key = self.keymap.get(key)
+        return mapped_key is not None and mapped_key in self
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __getattr__(self, key):
+        try:
+            return self[key]
+        except KeyError:
+            raise AttributeError(key)
+
+
+class ParsedFeed(FeedEntry):
+    """ Result of parse_feed, with the entries, bozo and bozo_exception keys of feedparser. """
+    pass
+
+
+def _strip_namespaces(element: ET.Element):
+    for child in element.iter():
+        if isinstance(child.tag, str) and child.tag.startswith('{'):
+            child.tag = child.tag.split('}', 1)[1]
+
+
+def _element_value(element: ET.Element) -> str:
+    """ Text of an element, including the markup of child elements (e.g. unescaped html in a description). """
+    if len(element) == 0:
+        return (element.text or '').strip()
+    _strip_namespaces(element)
+    parts = [element.text or '']
+    parts.extend(ET.tostring(child, encoding='unicode') for child in element)
+    return ''.join(parts).strip()
+
+
+def _text_construct(element: ET.Element, default_type: str) -> FeedEntry:
+    content_type = element.get('type')
+    if content_type is None:
+        content_type = default_type
+    else:
+        content_type = ATOM_TEXT_TYPES.get(content_type, content_type)
+
+    if content_type == 'application/xhtml+xml' and len(element) == 1:
+        # Atom xhtml content is wrapped in a div
+        value = _element_value(element[0])
+    else:
+        value = _element_value(element)
+
+    return FeedEntry(type=content_type, language=element.get('{%s}lang' % NS_XML), base='', value=value)
+
+
+def _parse_date(value: str) -> Optional[time.struct_time]:
+    try:
+        return time.gmtime(parse_date_epoch(value))
+    except (ValueError, TypeError, OverflowError):
+        return None
+
+
+def _set_text(entry: FeedEntry, key: str, element: ET.Element, default_type: str):
+    detail = _text_construct(element, default_type)
+    entry[key] = detail['value']
+    entry[key + '_detail'] = detail
+
+
+def _set_date(entry: FeedEntry, key: str, element: ET.Element):
+    value = (element.text or '').strip()
+    entry[key] = value
+    entry[key + '_parsed'] = _parse_date(value)
+
+
+def _add_media(entry: FeedEntry, element: ET.Element):
+    tag = element.tag
+    if tag == '{%s}content' % NS_MEDIA:
+        entry.setdefault('media_content', list()).append(dict(element.attrib))
+    elif tag == '{%s}thumbnail' % NS_MEDIA:
+        entry.setdefault('media_thumbnail', list()).append(dict(element.attrib))
+    elif tag == '{%s}group' % NS_MEDIA:
+        for child in element:
+            _add_media(entry, child)
+
+
+def entry_from_element(item: ET.Element) -> FeedEntry:
+    """ Maps an RSS item or Atom entry element to a feedparser style entry. """
+    entry = FeedEntry()
+    links: list[FeedEntry] = list()
+    tags: list[FeedEntry] = list()
+
+    for child in item:
+        tag = child.tag
+        if not isinstance(tag, str):
+            continue  # Comment or processing instruction
+        namespace, _, name = tag[1:].rpartition('}') if tag.startswith('{') else ('', '', tag)
+
+        if namespace in ('', NS_RSS1):
+            if name == 'title':
+                _set_text(entry, 'title', child, 'text/plain')
+            elif name == 'link':
+                href = (child.text or '').strip()
+                entry['link'] = href
+                links.append(FeedEntry(rel='alternate', type='text/html', href=href))
+            elif name == 'description':
+                _set_text(entry, 'summary', child, 'text/html')
+            elif name == 'pubDate':
+                _set_date(entry, 'published', child)
+            elif name == 'guid':
+                entry['id'] = (child.text or '').strip()
+            elif name == 'author':
+                entry['author'] = (child.text or '').strip()
+            elif name == 'category':
+                tags.append(FeedEntry(term=(child.text or '').strip(), scheme=child.get('domain'), label=None))
+            elif name == 'enclosure':
+                enclosure = FeedEntry(rel='enclosure', type=child.get('type', ''),
+                                      href=child.get('url', ''), length=child.get('length', ''))
+                links.append(enclosure)
+                entry.setdefault('enclosures', list()).append(enclosure)
+        elif namespace == NS_ATOM:
+            if name in ('title', 'summary', 'rights'):
+                _set_text(entry, name, child, 'text/plain')
+            elif name == 'content':
+                entry.setdefault('content', list()).append(_text_construct(child, 'text/plain'))
+            elif name == 'link':
+                link = FeedEntry(child.attrib)
+                link.setdefault('rel', 'alternate')
+                link.setdefault('type', 'text/html')
+                links.append(link)
+                if link['rel'] == 'alternate' and 'link' not in entry:
+                    entry['link'] = link.get('href', '')
+                elif link['rel'] == 'enclosure':
+                    entry.setdefault('enclosures', list()).append(link)
+            elif name in ('published', 'updated'):
+                _set_date(entry, name, child)
+            elif name == 'id':
+                entry['id'] = (child.text or '').strip()
+            elif name == 'author':
+                entry['author'] = (child.findtext('{%s}name' % NS_ATOM) or '').strip()
+            elif name == 'category':
+                tags.append(FeedEntry(term=child.get('term'), scheme=child.get('scheme'), label=child.get('label')))
+        elif namespace == NS_DC:
+            if name == 'date':
+                _set_date(entry, 'updated', child)
+            elif name == 'creator':
+                entry['author'] = (child.text or '').strip()
+            elif name == 'subject':
+                tags.append(FeedEntry(term=(child.text or '').strip(), scheme=None, label=None))
+        elif namespace == NS_CONTENT:
+            if name == 'encoded':
+                entry.setdefault('content', list()).append(_text_construct(child, 'text/html'))
+        elif namespace == NS_MEDIA:
+            _add_media(entry, child)
+
+    if 'id' not in entry:
+        about = item.get('{%s}about' % NS_RDF)  # RSS 1.0
+        if about is not None:
+            entry['id'] = about
+    if len(links) > 0:
+        entry['links'] = links
+    if len(tags) > 0:
+        entry['tags'] = tags
+    if 'summary' not in entry and 'content' in entry:
+        # Same as feedparser, the content doubles as summary
+        content = entry['content'][0]
+        entry['summary'] = content['value']
+        entry['summary_detail'] = content
+
+    return entry
+
+
+def sanitize_entry(entry: FeedEntry):
+    """ Sanitizes the html values of an entry (title, summary, content) the same way as feedparser. """
+    from feedparser.sanitizer import _sanitize_html  # Only needed for mappers requesting sanitized html
+
+    def sanitize(detail: FeedEntry) -> FeedEntry:
+        if detail.get('type') in HTML_TYPES and detail.get('value'):
+            detail['value'] = _sanitize_html(detail['value'], 'utf-8', detail['type'])
+        return detail
+
+    for key in ('title', 'summary', 'rights'):
+        detail = entry.get(key + '_detail')
+        if detail is not None:
+            entry[key] = sanitize(detail)['value']
+    for content in entry.get('content') or list():
+        if content is not entry.get('summary_detail'):
+            sanitize(content)
+
+
+def iter_feed_entries(data: Union[str, bytes]) -> Iterator[FeedEntry]:
+    """
+    Parses the entries of an RSS or Atom feed incrementally.
+    :raises ET.ParseError: When the document is not valid, possibly after some entries were yielded
+    """
+    for item in iter_xml_items(data):
+        yield entry_from_element(item)
+
+
+def parse_feed(data: Union[str, bytes], sanitize=False) -> ParsedFeed:
+    """
+    Compatibility mode for mappers written for feedparser.parse().
+    Documents that are not well-formed XML (e.g. html entities) are parsed by feedparser, it recovers
+    the entries after the error.
+    :param sanitize: Sanitizes the html of the entries like feedparser (removes scripts, event handlers, etc.).
+                     By default summary and content are the raw html of the feed.
+    """
+    entries: list[FeedEntry] = list()
+    feed = ParsedFeed(entries=entries, bozo=False)
+    try:
+        for entry in iter_feed_entries(data):
+            if sanitize:
+                sanitize_entry(entry)
+            entries.append(entry)
+    except ET.ParseError:
+        import feedparser  # Slow to import, only needed for invalid documents
+        return feedparser.parse(data)
+    return feed
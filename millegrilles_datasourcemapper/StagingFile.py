@@ -0,0 +1,293 @@
+import asyncio
+import gzip
+import json
+import logging
+import os
+import pathlib
+
+from typing import AsyncIterator, Callable, Optional, TypedDict
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+# Staging files are made of independently compressed chunks. The index (json) lists the chunks with
+# their offset, size, codec and date ranges, allowing parallel or partial reads and cheap appends.
+
+INDEX_VERSION = 1
+CONST_CHUNK_MAX_ITEMS = 64
+CONST_CHUNK_MAX_BYTES = 4 * 1024 * 1024
+
+
+class StagingCodec:
+
+    name = 'none'
+
+    def compress(self, data: bytes) -> bytes:
+        return data
+
+    def decompress(self, data: bytes) -> bytes:
+        return data
+
+
+class GzipStagingCodec(StagingCodec):
+
+    name = 'gzip'
+
+    def compress(self, data: bytes) -> bytes:
+        return gzip.compress(data, compresslevel=1)
+
+    def decompress(self, data: bytes) -> bytes:
+        return gzip.decompress(data)
+
+
+class ZstdStagingCodec(StagingCodec):
+
+    name = 'zstd'
+
+    def compress(self, data: bytes) -> bytes:
+        return zstandard.ZstdCompressor(level=3).compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        return zstandard.ZstdDecompressor().decompress(data)
+
+
+class Lz4StagingCodec(StagingCodec):
+
+    name = 'lz4'
+
+    def compress(self, data: bytes) -> bytes:
+        return lz4.frame.compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        return lz4.frame.decompress(data)
+
+
+def available_codecs() -> dict[str, StagingCodec]:
+    codecs: dict[str, StagingCodec] = {'none': StagingCodec(), 'gzip': GzipStagingCodec()}
+    if zstandard is not None:
+        codecs['zstd'] = ZstdStagingCodec()
+    if lz4 is not None:
+        codecs['lz4'] = Lz4StagingCodec()
+    return codecs
+
+
+def get_codec(name: Optional[str] = None) -> StagingCodec:
+    """
+    :param name: Codec name (zstd, lz4, gzip, none). When None, the fastest available codec is selected.
+    :return: Codec
+    """
+    codecs = available_codecs()
+    if name is None or name == '':
+        for preferred in ['zstd', 'lz4', 'gzip']:
+            try:
+                return codecs[preferred]
+            except KeyError:
+                pass
+    try:
+        return codecs[name]
+    except KeyError:
+        raise ValueError('Staging codec %s is not available' % name)
+
+
+class StagingChunk(TypedDict):
+    offset: int
+    length: int
+    count: int
+    codec: str
+    save_date_min: Optional[int]
+    save_date_max: Optional[int]
+    pub_date_min: Optional[int]
+    pub_date_max: Optional[int]
+
+
+def get_index_path(path: pathlib.Path) -> pathlib.Path:
+    return pathlib.Path(f'{path}.idx')
+
+
+def load_index(path: pathlib.Path) -> list[StagingChunk]:
+    try:
+        with open(get_index_path(path)) as fp:
+            index = json.load(fp)
+    except FileNotFoundError:
+        return list()
+    if index.get('version') != INDEX_VERSION:
+        raise ValueError('Unsupported staging index version %s' % index.get('version'))
+    return index['chunks']
+
+
+def delete_staging(path: pathlib.Path):
+    for file_path in [path, get_index_path(path)]:
+        try:
+            os.unlink(file_path)
+        except FileNotFoundError:
+            pass
+
+
+def _min(current: Optional[int], value: Optional[int]) -> Optional[int]:
+    if value is None:
+        return current
+    if current is None or value < current:
+        return value
+    return current
+
+
+def _max(current: Optional[int], value: Optional[int]) -> Optional[int]:
+    if value is None:
+        return current
+    if current is None or value > current:
+        return value
+    return current
+
+
+class StagingWriter:
+    """
+    Appends records to a staging file. Blocking, run in a thread.
+    Records are only visible to readers once their chunk has been flushed.
+    """
+
+    def __init__(self, path: pathlib.Path, codec: StagingCodec, append=True,
+                 chunk_max_items=CONST_CHUNK_MAX_ITEMS, chunk_max_bytes=CONST_CHUNK_MAX_BYTES):
+        self.__path = path
+        self.__codec = codec
+        self.__chunk_max_items = chunk_max_items
+        self.__chunk_max_bytes = chunk_max_bytes
+
+        if append:
+            self.__chunks = load_index(path)
+        else:
+            delete_staging(path)
+            self.__chunks = list()
+
+        # Drop content written after the last indexed chunk (interrupted flush)
+        self.__end_offset = 0
+        if len(self.__chunks) > 0:
+            last_chunk = self.__chunks[-1]
+            self.__end_offset = last_chunk['offset'] + last_chunk['length']
+        self.__fp = open(path, 'r+b' if path.exists() else 'w+b')
+        self.__fp.truncate(self.__end_offset)
+        self.__fp.seek(self.__end_offset)
+
+        self.__buffer: list[bytes] = list()
+        self.__buffer_size = 0
+        self.__current_chunk: Optional[StagingChunk] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def write(self, record: dict, save_date: Optional[int] = None,
+              pub_date_start: Optional[int] = None, pub_date_end: Optional[int] = None):
+        line = json.dumps(record).encode('utf-8') + b'\n'
+        self.__buffer.append(line)
+        self.__buffer_size += len(line)
+
+        chunk = self.__current_chunk
+        if chunk is None:
+            chunk = {'offset': 0, 'length': 0, 'count': 0, 'codec': self.__codec.name,
+                     'save_date_min': None, 'save_date_max': None, 'pub_date_min': None, 'pub_date_max': None}
+            self.__current_chunk = chunk
+        chunk['count'] += 1
+        chunk['save_date_min'] = _min(chunk['save_date_min'], save_date)
+        chunk['save_date_max'] = _max(chunk['save_date_max'], save_date)
+        chunk['pub_date_min'] = _min(chunk['pub_date_min'], pub_date_start)
+        chunk['pub_date_max'] = _max(chunk['pub_date_max'], pub_date_end or pub_date_start)
+
+        if len(self.__buffer) >= self.__chunk_max_items or self.__buffer_size >= self.__chunk_max_bytes:
+            self.flush()
+
+    def flush(self):
+        """ Writes the buffered records as a new chunk and saves the index. """
+        chunk = self.__current_chunk
+        if chunk is None:
+            return
+
+        content = self.__codec.compress(b''.join(self.__buffer))
+        self.__buffer.clear()
+        self.__buffer_size = 0
+        self.__current_chunk = None
+
+        chunk['offset'] = self.__end_offset
+        chunk['length'] = len(content)
+        self.__fp.write(content)
+        self.__fp.flush()
+        self.__end_offset += len(content)
+        self.__chunks.append(chunk)
+
+        index_path = get_index_path(self.__path)
+        temp_index_path = pathlib.Path(f'{index_path}.tmp')
+        with open(temp_index_path, 'wt') as fp:
+            json.dump({'version': INDEX_VERSION, 'chunks': self.__chunks}, fp)
+        os.replace(temp_index_path, index_path)
+
+    def close(self):
+        if self.__fp.closed:
+            return
+        try:
+            self.flush()
+        finally:
+            self.__fp.close()
+
+
+def read_chunk(path: pathlib.Path, chunk: StagingChunk) -> list[dict]:
+    """ Reads and decodes all records of a chunk. Blocking, run in a thread. """
+    codec = get_codec(chunk['codec'])
+    with open(path, 'rb') as fp:
+        fp.seek(chunk['offset'])
+        content = fp.read(chunk['length'])
+    content = codec.decompress(content)
+    return [json.loads(line) for line in content.splitlines()]
+
+
+async def iter_staging_records(path: pathlib.Path, parallelism=2,
+                               chunk_filter: Optional[Callable[[StagingChunk], bool]] = None) -> AsyncIterator[dict]:
+    """
+    Reads the records of a staging file in order, decoding up to parallelism chunks ahead in threads.
+    :param path: Staging file
+    :param parallelism: Number of chunks decoded simultaneously
+    :param chunk_filter: Optional filter to read only a range of chunks (e.g. pub dates)
+    """
+    chunks = load_index(path)
+    if chunk_filter is not None:
+        chunks = [c for c in chunks if chunk_filter(c)]
+
+    pending: list[asyncio.Task] = list()
+    position = 0
+    try:
+        while position < len(chunks) or len(pending) > 0:
+            while position < len(chunks) and len(pending) < parallelism:
+                pending.append(asyncio.create_task(asyncio.to_thread(read_chunk, path, chunks[position])))
+                position += 1
+            records = await pending.pop(0)
+            for record in records:
+                yield record
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def convert_jsonl_gz(source: pathlib.Path, destination: pathlib.Path, codec: Optional[StagingCodec] = None) -> int:
+    """
+    Converts a jsonl.gz staging file to the chunked staging format. Blocking, run in a thread.
+    :return: Number of records converted
+    """
+    if codec is None:
+        codec = get_codec()
+    count = 0
+    with gzip.open(source, 'rt') as input_file:
+        with StagingWriter(destination, codec, append=True) as writer:
+            for line in input_file:
+                if line.strip() == '':
+                    continue
+                writer.write(json.loads(line))
+                count += 1
+    logging.getLogger(__name__).info("Converted %d records from %s to %s", count, source, destination)
+    return count
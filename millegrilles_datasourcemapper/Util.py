@@ -3,4 +3,8 @@ import binascii
 def decode_base64_nopad(value: str) -> bytes:
     value += "=" * ((4 - len(value) % 4) % 4)  # Padding
     value_bytes: bytes = binascii.a2b_base64(value)
-    return value_bytes
\ No newline at end of file
+    return value_bytes
+
+
+def encode_base64_nopad(value: bytes) -> str:
+    return binascii.b2a_base64(value, newline=False).decode('utf-8').rstrip('=')
@@ -1,4 +1,4 @@
-import feedparser
+from millegrilles_datasourcemapper.RssParser import parse_feed
 from datetime import datetime
 from typing import AsyncIterable
 from millegrilles_datasourcemapper.DataParserUtilities import DatedItemData
@@ -11,7 +11,7 @@ async def parse(data: str) -> AsyncIterable[DatedItemData]:
     """
 
     # Parse the RSS feed
-    feed = feedparser.parse(data)
+    feed = parse_feed(data, sanitize=True)
 
     for entry in feed.entries:
         date = int(datetime(*entry.published_parsed[:6]).timestamp())
@@ -1,7 +1,6 @@
-import feedparser
-from datetime import datetime
+from millegrilles_datasourcemapper.RssParser import parse_feed
 from typing import AsyncIterable, Optional
-from millegrilles_datasourcemapper.DataParserUtilities import DatedItemData
+from millegrilles_datasourcemapper.DataParserUtilities import DatedItemData, parse_date_epoch
 
 async def parse(data: str) -> AsyncIterable[DatedItemData]:
     """
@@ -10,7 +9,7 @@ async def parse(data: str) -> AsyncIterable[DatedItemData]:
     """
 
     # Parse the RSS feed
-    feed = feedparser.parse(data)
+    feed = parse_feed(data, sanitize=True)
 
     # Loop through each item in the feed
     for entry in feed.entries:
@@ -19,7 +18,7 @@ async def parse(data: str) -> AsyncIterable[DatedItemData]:
         pub_date_str = entry.published
 
         # Convert the publication date to epoch seconds
-        pub_date = int(datetime.strptime(pub_date_str, "%a, %d %b %Y %H:%M:%S GMT").timestamp())
+        pub_date = parse_date_epoch(pub_date_str)
 
         # Extract optional data
         summary = entry.summary if 'summary' in entry else None
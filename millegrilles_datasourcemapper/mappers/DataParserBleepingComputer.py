@@ -1,8 +1,6 @@
 from typing import AsyncIterable
-import xml.etree.ElementTree as ET
-from datetime import datetime
 
-from millegrilles_datasourcemapper.DataParserUtilities import DatedItemData
+from millegrilles_datasourcemapper.DataParserUtilities import DatedItemData, iter_xml_items, parse_date_epoch
 
 
 async def parse(data: str) -> AsyncIterable[DatedItemData]:
@@ -23,11 +21,8 @@ async def parse(data: str) -> AsyncIterable[DatedItemData]:
         * keywords: all categories joined by a comma.
     """
 
-    # Parse the XML data
-    root = ET.fromstring(data)
-
-    # Iterate over each <item> element within the feed (typically under <channel>)
-    for item in root.findall('.//item'):
+    # Iterate over each <item> element within the feed (typically under <channel>), parsed incrementally
+    for item in iter_xml_items(data, 'item'):
         # Extract title from <title>
         title = item.findtext('title', default='')
 
@@ -39,8 +34,7 @@ async def parse(data: str) -> AsyncIterable[DatedItemData]:
         if pub_date_str:
             try:
                 # Parse the date string (e.g., "Sat, 17 May 2025 10:09:19 -0400")
-                dt = datetime.strptime(pub_date_str, '%a, %d %b %Y %H:%M:%S %z')
-                epoch_seconds = int(dt.timestamp())
+                epoch_seconds = parse_date_epoch(pub_date_str)
             except Exception:
                 # Fallback if date parsing fails
                 epoch_seconds = 0
@@ -1,4 +1,4 @@
-import feedparser
+from millegrilles_datasourcemapper.RssParser import parse_feed
 from typing import AsyncIterable
 from datetime import datetime
 from bs4 import BeautifulSoup
@@ -14,7 +14,7 @@ async def parse(data: str) -> AsyncIterable[DatedItemData]:
     """
 
     # Parse the RSS feed
-    feed = feedparser.parse(data)
+    feed = parse_feed(data, sanitize=True)
 
     for entry in feed.entries:
         date_epoch = int(datetime(*entry.published_parsed[:6]).timestamp())
@@ -1,4 +1,4 @@
-import feedparser
+from millegrilles_datasourcemapper.RssParser import parse_feed
 from datetime import datetime
 from typing import AsyncIterable, Optional
 from millegrilles_datasourcemapper.DataParserUtilities import DatedItemData
@@ -9,7 +9,7 @@ async def parse(data: str) -> AsyncIterable[DatedItemData]:
     :param data: Input data, same structure as the provided sample.
     """
 
-    feed = feedparser.parse(data)
+    feed = parse_feed(data, sanitize=True)
 
     for entry in feed.entries:
         date = int(datetime(*entry.published_parsed[:6]).timestamp())
@@ -1,8 +1,7 @@
 from typing import AsyncIterable
-from datetime import datetime
-import xml.etree.ElementTree as ET
 
-from millegrilles_datasourcemapper.DataParserUtilities import GroupedDatedItemData, GroupData
+from millegrilles_datasourcemapper.DataParserUtilities import GroupedDatedItemData, GroupData, iter_xml_items, \
+    parse_date_epoch
 
 async def parse(data: str) -> AsyncIterable[GroupedDatedItemData]:
     """
@@ -16,17 +15,14 @@ async def parse(data: str) -> AsyncIterable[GroupedDatedItemData]:
     The group data is built from the parent <item> element.
     """
 
-    # Parse the XML string into an ElementTree
-    root = ET.fromstring(data)
-
     # Define namespaces used in the RSS feed
     ns = {
         'atom': "http://www.w3.org/2005/Atom",
         'ht': "https://trends.google.com/trending/rss"
     }
 
-    # Loop over each <item> element (grouping by item)
-    for item in root.findall(".//channel//item"):
+    # Loop over each <item> element (grouping by item), parsed incrementally
+    for item in iter_xml_items(data, "item", ns):
         # Extract group label from the item's title
         group_label = item.findtext("title")
         approx_traffic = item.findtext("ht:approx_traffic", namespaces=ns)
@@ -36,8 +32,7 @@ async def parse(data: str) -> AsyncIterable[GroupedDatedItemData]:
         if pub_date_str:
             try:
                 # The format is e.g., "Sat, 17 May 2025 11:20:00 -0700"
-                dt = datetime.strptime(pub_date_str, "%a, %d %b %Y %H:%M:%S %z")
-                epoch_date = int(dt.timestamp())
+                epoch_date = parse_date_epoch(pub_date_str)
             except Exception:
                 epoch_date = None
         else:
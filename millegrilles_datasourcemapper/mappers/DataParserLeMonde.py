@@ -1,9 +1,8 @@
 from typing import AsyncIterable
-import feedparser
-from datetime import datetime
 import pytz
 
-from millegrilles_datasourcemapper.DataParserUtilities import DatedItemData
+from millegrilles_datasourcemapper.DataParserUtilities import DatedItemData, parse_date_epoch
+from millegrilles_datasourcemapper.RssParser import parse_feed
 
 async def parse(data: str) -> AsyncIterable[DatedItemData]:
     """
@@ -12,7 +11,7 @@ async def parse(data: str) -> AsyncIterable[DatedItemData]:
     """
 
     # Parse the RSS feed
-    feed = feedparser.parse(data)
+    feed = parse_feed(data, sanitize=True)
 
     # Loop through each item in the feed
     for entry in feed.entries:
@@ -21,8 +20,7 @@ async def parse(data: str) -> AsyncIterable[DatedItemData]:
         pub_date_str = entry.published
 
         # Convert the publication date to epoch seconds
-        pub_date = datetime.strptime(pub_date_str, '%a, %d %b %Y %H:%M:%S %z')
-        date = int(pub_date.timestamp())
+        date = parse_date_epoch(pub_date_str)
 
         # Extract optional data
         summary = entry.summary
@@ -1,21 +1,11 @@
 from typing import AsyncIterable
 import asyncio
-import xml.etree.ElementTree as ET
-from datetime import datetime
-from millegrilles_datasourcemapper.DataParserUtilities import DatedItemData
+from millegrilles_datasourcemapper.DataParserUtilities import DatedItemData, iter_xml_items, parse_date_epoch
 
 
 async def parse(data: str) -> AsyncIterable[DatedItemData]:
-    # Parse the XML data using ElementTree.
-    root = ET.fromstring(data)
-
-    # Find all <item> elements. The items are expected to be direct children of <channel>.
-    channel = root.find('channel')
-    if channel is None:
-        return  # No channel found, nothing to yield.
-
-    # Loop over each item element.
-    for item in channel.findall('item'):
+    # Loop over each <item> element (children of <channel>), parsed incrementally.
+    for item in iter_xml_items(data, 'item'):
         # Extract the title text as label. If not present, use an empty string.
         title_elem = item.find('title')
         label = title_elem.text.strip() if title_elem is not None and title_elem.text else ""
@@ -34,17 +24,14 @@ async def parse(data: str) -> AsyncIterable[DatedItemData]:
             continue  # Skip this item if no publication date is provided.
         pub_date_str = pubdate_elem.text.strip()
 
-        # Parse the publication date string into a datetime object.
+        # Parse the publication date string to epoch seconds.
         try:
             # Expected format: "Monday, May 19, 2025 - 13:36"
-            dt = datetime.strptime(pub_date_str, "%A, %B %d, %Y - %H:%M")
+            date_epoch = parse_date_epoch(pub_date_str, ("%A, %B %d, %Y - %H:%M",))
         except Exception as e:
             # If parsing fails, skip this item.
             continue
 
-        # Convert the datetime to epoch seconds (as an integer).
-        date_epoch = int(dt.timestamp())
-
         # Create a DatedItemData object with mandatory attributes.
         dated_item = DatedItemData(label=label, date=date_epoch)
 
@@ -1,7 +1,6 @@
-import feedparser
-from datetime import datetime
+from millegrilles_datasourcemapper.RssParser import parse_feed
 from typing import AsyncIterable
-from millegrilles_datasourcemapper.DataParserUtilities import DatedItemData
+from millegrilles_datasourcemapper.DataParserUtilities import DatedItemData, parse_date_epoch
 import re
 
 async def parse(data: str) -> AsyncIterable[DatedItemData]:
@@ -11,7 +10,7 @@ async def parse(data: str) -> AsyncIterable[DatedItemData]:
     """
 
     # Parse the RSS feed
-    feed = feedparser.parse(data)
+    feed = parse_feed(data, sanitize=True)
 
     for entry in feed.entries:
         date_str = entry.get('published')
@@ -20,7 +19,7 @@ async def parse(data: str) -> AsyncIterable[DatedItemData]:
 
         # Convert date to epoch seconds
         try:
-            date_epoch = int(datetime.strptime(date_str, "%a, %d %b %Y %H:%M:%S %Z").timestamp())
+            date_epoch = parse_date_epoch(date_str)
         except ValueError:
             continue
 
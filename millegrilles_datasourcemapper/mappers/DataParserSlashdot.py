@@ -1,8 +1,6 @@
-import xml.etree.ElementTree as ET
-from datetime import datetime
 from typing import AsyncIterable
 
-from millegrilles_datasourcemapper.DataParserUtilities import DatedItemData
+from millegrilles_datasourcemapper.DataParserUtilities import DatedItemData, iter_xml_items, parse_date_epoch
 
 async def parse(data: str) -> AsyncIterable[DatedItemData]:
     """
@@ -18,12 +16,10 @@ async def parse(data: str) -> AsyncIterable[DatedItemData]:
         "slash": "http://purl.org/rss/1.0/modules/slash/"
     }
 
-    root = ET.fromstring(data)
-
-    for item in root.findall('.//item', ns):
+    for item in iter_xml_items(data, 'item', ns):
         title = item.find('title', ns).text
         date_str = item.find('dc:date', ns).text
-        date = int(datetime.strptime(date_str, '%Y-%m-%dT%H:%M:%S%z').timestamp())
+        date = parse_date_epoch(date_str)
 
         data_str = {}
         data_str['description'] = item.find('description', ns).text
@@ -1,7 +1,5 @@
 from typing import AsyncIterable, Optional, Union
-import xml.etree.ElementTree as ET
-from datetime import datetime
-from millegrilles_datasourcemapper.DataParserUtilities import DatedItemData
+from millegrilles_datasourcemapper.DataParserUtilities import DatedItemData, iter_xml_items, parse_date_epoch
 
 
 async def parse(data: str) -> AsyncIterable[DatedItemData]:
@@ -18,13 +16,8 @@ async def parse(data: str) -> AsyncIterable[DatedItemData]:
         'xhtml': "http://www.w3.org/1999/xhtml"
     }
 
-    # Parse the XML data.
-    root = ET.fromstring(data)
-
-    # Find all <entry> elements within the feed.
-    entries = root.findall('.//atom:entry', ns)
-
-    for entry in entries:
+    # Parse the <entry> elements of the feed incrementally.
+    for entry in iter_xml_items(data, 'atom:entry', ns):
         # Extract the title text. The <title> element is of type "xhtml", so its content may be inside a nested <div>.
         title_elem = entry.find('atom:title', ns)
         label_text = ""
@@ -44,8 +37,7 @@ async def parse(data: str) -> AsyncIterable[DatedItemData]:
         epoch_time = 0
         if updated_elem is not None and updated_elem.text:
             try:
-                dt = datetime.strptime(updated_elem.text, "%Y-%m-%dT%H:%M:%S%z")
-                epoch_time = int(dt.timestamp())
+                epoch_time = parse_date_epoch(updated_elem.text)
             except Exception:
                 epoch_time = 0
 